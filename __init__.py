@@ -1,10 +1,13 @@
 # from .<fileName> import <className>
-from .log import Log, ConsoleColors
+from .log import Log, ConsoleColors, LogHandler, StreamHandler, RotatingFileHandler, JSONLinesHandler, MemoryHandler, \
+    QueueHandler, LogQueueListener
 from .webdriver import FirefoxDriver, ChromeDriver, WebDriver
-from .sqlite3 import SQLite3
+from .sqlite3 import SQLite3, SQLite3Pool, AsyncSQLite3
 from .mimetypes import MimeTypes, _MimeEntryReflection as MimeEntry
-from .pdfutil import PDFUtil
-from .curldownloader import CurlDownloader
+from .pdfutil import PDFUtil, PDFTextCache
+from .curldownloader import CurlDownloader, MultiCurlDownloader, AsyncCurlDownloader, HTTPResult, HTTPHeaders, \
+    HTTPStream, HostScheduler
+from .httpcache import HTTPCache
 from .file import FileUtil
 
 
@@ -0,0 +1,27 @@
+"""Helpers shared by the benchmark scripts; run those as ``python benchmarks/<script>.py``."""
+import importlib
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS_DIR = os.path.join(ROOT, 'tests')
+
+
+def load_package():
+    """The repository root is the package itself: import it by its directory name from the parent directory."""
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != ROOT]
+    sys.path.insert(0, os.path.dirname(ROOT))
+    return importlib.import_module(os.path.basename(ROOT))
+
+
+def per_call(func, *args, min_time: float = 0.2) -> float:
+    """Seconds per ``func(*args)``, repeated until ``min_time`` has passed."""
+    n, elapsed = 1, 0.0
+    while elapsed < min_time:
+        n *= 2
+        start = time.perf_counter()
+        for _ in range(n):
+            func(*args)
+        elapsed = time.perf_counter() - start
+    return elapsed / n
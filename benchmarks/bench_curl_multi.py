@@ -0,0 +1,68 @@
+"""
+CurlDownloader.get one URL at a time versus get_many on a CurlMulti, against a local http.server whose handler
+waits DELAY seconds before answering (a stand-in for network and server latency). Everything is one host, so
+max_per_host is what bounds get_many.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from _bench import load_package
+
+package = load_package()
+
+URLS = 200
+DELAY = 0.02
+BODY = b'x' * 2048
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default backlog of 5 drops connects once get_many opens more at once
+
+
+class DelayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled connections are reused
+    wbufsize = -1  # headers and body in one send; split writes hit Nagle / delayed-ACK stalls of ~40 ms
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(DELAY)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+
+def rate(label: str, func):
+    start = time.perf_counter()
+    ok = func()
+    elapsed = time.perf_counter() - start
+    print('%-36s %6.2f s %7.0f req/s  %d/%d ok' % (label, elapsed, URLS / elapsed, ok, URLS))
+
+
+def main():
+    server = Server(('127.0.0.1', 0), DelayHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = ['http://127.0.0.1:%d/%d' % (server.server_port, i) for i in range(URLS)]
+    downloader = package.CurlDownloader()
+
+    def serial():
+        return sum(downloader.get(url).get_status_code() == 200 for url in urls)
+
+    def concurrent(concurrency: int, max_per_host: int):
+        return lambda: sum(result.get_status_code() == 200 for _, result in
+                           downloader.get_many(urls, concurrency=concurrency, max_per_host=max_per_host))
+
+    print('%d GETs, %.0f ms server delay' % (URLS, DELAY * 1000))
+    rate('serial get', serial)
+    rate('get_many concurrency=10 per_host=2', concurrent(10, 2))
+    rate('get_many concurrency=10 per_host=10', concurrent(10, 10))
+    rate('get_many concurrency=50 per_host=50', concurrent(50, 50))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Log throughput from 8 threads into a slow stderr (a pipe costing 50 us per write), synchronously and through the
+asynchronous sink with each overflow policy. 'callers' is how fast the logging calls return, 'end-to-end' includes
+Log.flush(). Then the cost of a single call: Log.d below the level, and a formatted Log.d from a method into a
+null stream, with the caller label caches (class / file name per code object) on and bypassed.
+"""
+import importlib
+import io
+import sys
+import threading
+import time
+
+from _bench import load_package, per_call
+
+package = load_package()
+Log = package.Log
+log_module = importlib.import_module(package.__name__ + '.log')
+
+THREADS = 8
+RECORDS = 2000
+
+
+class SlowPipe(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def write(self, s):
+        with self._lock:
+            time.sleep(0.00005)
+            return super().write(s)
+
+
+def run(label: str, **async_options):
+    pipe = sys.stderr = SlowPipe()  # StreamHandler looks sys.stderr up on every write
+    if async_options:
+        Log.set_async(True, **async_options)
+
+    def worker():
+        for i in range(RECORDS):
+            Log.d('record %d', i)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    returned = time.perf_counter() - start
+    Log.flush()
+    finished = time.perf_counter() - start
+    dropped = Log.get_dropped_count()
+    if async_options:
+        Log.set_async(False)
+    sys.stderr = sys.__stderr__
+    total = THREADS * RECORDS
+    print('%-26s callers %8.0f rec/s, end-to-end %8.0f rec/s, written %5d, dropped %5d'
+          % (label, total / returned, total / finished, pipe.getvalue().count('\n'), dropped))
+
+
+class NullStream:
+    def write(self, s):
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+class Caller:
+    def formatted(self):
+        Log.d('fetched %s in %.2fs', 'http://example.com/', 0.25)
+
+
+def calls():
+    caller = Caller()
+    Log.set_level(Log.Level.INFO)
+    print('%-34s %7.0f ns' % ('Log.d below the level', per_call(Log.d, 'fetched %s', 'x') * 1e9))
+    Log.set_level(Log.Level.ALL)
+    sys.stderr = NullStream()
+    try:
+        print('%-34s %7.0f ns' % ('formatted Log.d, label cache', per_call(caller.formatted) * 1e9))
+        cached = {name: getattr(log_module, name) for name in ('_class_label', '_file_label', '_may_hold_owner')}
+        for name, func in cached.items():
+            setattr(log_module, name, func.__wrapped__)
+        try:
+            print('%-34s %7.0f ns' % ('formatted Log.d, no label cache', per_call(caller.formatted) * 1e9))
+        finally:
+            for name, func in cached.items():
+                setattr(log_module, name, func)
+    finally:
+        sys.stderr = sys.__stderr__
+
+
+def main():
+    run('sync')
+    run('async BLOCK', overflow=Log.Overflow.BLOCK)
+    run('async DROP_OLDEST q=1000', overflow=Log.Overflow.DROP_OLDEST, queue_size=1000)
+    run('async DROP q=1000', overflow=Log.Overflow.DROP, queue_size=1000)
+    calls()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Accuracy and per-call cost of MimeTypes sniffing over the sample corpus of tests/mime_corpus.py:
+guess_by_file on every sample, then guess_by_bytes on the first _SNIFF_SIZE + 1 bytes (what guess_by_file reads).
+"""
+import os
+import sys
+import tempfile
+
+from _bench import TESTS_DIR, load_package, per_call
+
+package = load_package()
+sys.path.insert(0, TESTS_DIR)
+from mime_corpus import build_corpus  # noqa: E402
+
+
+def main():
+    mime = package.MimeTypes
+    corpus = build_corpus()
+    correct = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for name, content, expected in corpus:
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            got = str(mime.guess_by_file(path))
+            correct += got == expected
+            if got != expected:
+                print('%-16s got %s, expected %s' % (name, got, expected))
+    print('guess_by_file accuracy: %d/%d' % (correct, len(corpus)))
+    print('guess_by_bytes per call:')
+    for name, content, _ in corpus:
+        head = content[:mime._SNIFF_SIZE + 1]
+        print('  %-16s %7.1f us' % (name, per_call(mime.guess_by_bytes, head) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Per-call cost of MimeTypes.guess_by_bytes on whole in-memory documents, from a couple of bytes to 20 MB. The cost
+should not grow with the input: only the first _SNIFF_SIZE bytes are looked at.
+"""
+import random
+
+from _bench import load_package, per_call
+
+MimeTypes = load_package().MimeTypes
+
+
+def build_inputs() -> dict:
+    noise = random.Random(1).randbytes
+    return {
+        'pdf 2 MB': b'%PDF-1.7\n' + noise(2 << 20),
+        'png 500 KB': b'\x89PNG\r\n\x1a\n' + noise(500 << 10),
+        'jpeg 300 KB': b'\xff\xd8\xff\xe0' + noise(300 << 10),
+        'gif 100 KB': b'GIF89a' + noise(100 << 10),
+        'html 240 KB': b'<!DOCTYPE html><html>' + 'héllo wörld '.encode() * 20000,
+        'json 300 KB': b'{"a": [' + b'1, ' * 100000 + b'2]}',
+        'xml 200 KB': b'<?xml version="1.0"?><r>' + b'<x/>' * 50000 + b'</r>',
+        'text 20 MB': 'plain text line ünïcode\n'.encode() * 800000,
+        'random 1 MB': noise(1 << 20),
+        'svg': b'<svg xmlns="http://www.w3.org/2000/svg"></svg>',
+        '2 bytes': b'hi',
+        'empty': b'',
+    }
+
+
+def main():
+    for name, content in build_inputs().items():
+        mime = MimeTypes.guess_by_bytes(content)
+        print('%-12s %-26s %8.1f us' % (name, mime, per_call(MimeTypes.guess_by_bytes, content) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Single-row writes from CLIENTS coroutines, each awaiting its writes one after another, on a file database in WAL
+mode: AsyncSQLite3, which groups the pending writes into one transaction, versus the blocking SQLite3 driven
+through run_in_executor with a commit per write (a lock serialises the shared connection, as one would have to).
+Also reports the longest event loop stall seen by a 1 ms ticker while the writes run.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _bench import load_package
+
+package = load_package()
+
+CLIENTS = 50
+WRITES = 5000
+
+
+async def ticker(stop: asyncio.Event, stalls: list):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        stalls.append(now - last)
+        last = now
+
+
+async def client(write, n: int):
+    for i in range(n, WRITES, CLIENTS):
+        await write(i)
+
+
+async def measure(label: str, write):
+    stop, stalls = asyncio.Event(), []
+    tick = asyncio.ensure_future(ticker(stop, stalls))
+    start = time.perf_counter()
+    await asyncio.gather(*(client(write, n) for n in range(CLIENTS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    print('%-46s %8.0f writes/s  max loop stall %5.1f ms' % (label, WRITES / elapsed, max(stalls) * 1000))
+
+
+def create(path: str):
+    db = package.SQLite3(path)
+    db.create_table_if_not_exists('t', ['id', 'name'], ['integer', 'text'])
+    db.commit()
+    db.close()
+
+
+async def with_async(path: str):
+    create(path)
+    db = package.AsyncSQLite3(path)
+    await measure('AsyncSQLite3', lambda i: db.execute('insert into t values (?, ?)', (i, 'row')))
+    await db.close()
+
+
+async def with_executor(path: str, workers: int):
+    create(path)
+    db = package.SQLite3(path, performance=True, check_same_thread=False)
+    lock = threading.Lock()
+
+    def write(i: int):
+        with lock:
+            db.execute('insert into t values (?, ?)', (i, 'row'))
+            db.commit()
+
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(workers) as executor:
+        await measure('SQLite3 in ThreadPoolExecutor(%d), commit each' % workers,
+                      lambda i: loop.run_in_executor(executor, write, i))
+    db.close()
+
+
+def main():
+    print('%d single-row inserts from %d concurrent clients, WAL' % (WRITES, CLIENTS))
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(with_async(os.path.join(directory, 'async.db')))
+        for workers in (1, 4):
+            asyncio.run(with_executor(os.path.join(directory, 'executor%d.db' % workers), workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Insert throughput of SQLite3 on a file database (2-column rows): execute + commit per row, an execute loop with a
+single commit, and bulk_insert with batch_size=10000, plus an 'update' upsert over rows that all exist already.
+"""
+import os
+import tempfile
+import time
+
+from _bench import load_package
+
+SQLite3 = load_package().SQLite3
+
+ROWS = 200000
+ROWS_COMMIT_EACH = 2000
+
+
+def rate(label: str, rows: int, func):
+    start = time.perf_counter()
+    func()
+    print('%-38s %9.0f rows/s' % (label, rows / (time.perf_counter() - start)))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        db = SQLite3(os.path.join(directory, 'bench.db'))
+        for table in ('per_row', 'loop', 'bulk'):
+            db.create_table_if_not_exists(table, ['id', 'name'], ['integer primary key', 'text'])
+        db.commit()
+
+        def per_row():
+            for i in range(ROWS_COMMIT_EACH):
+                db.execute('insert into per_row values (?, ?)', (i, 'row'))
+                db.commit()
+
+        def loop():
+            for i in range(ROWS):
+                db.execute('insert into loop values (?, ?)', (i, 'row'))
+            db.commit()
+
+        rate('execute + commit per row', ROWS_COMMIT_EACH, per_row)
+        rate('execute loop, single commit', ROWS, loop)
+        rate('bulk_insert, batch_size=10000', ROWS,
+             lambda: db.bulk_insert('bulk', ((i, 'row') for i in range(ROWS)), ['id', 'name'], batch_size=10000))
+        rate('bulk_insert upsert, batch_size=10000', ROWS,
+             lambda: db.bulk_insert('bulk', ((i, 'new') for i in range(ROWS)), ['id', 'name'], batch_size=10000,
+                                    on_conflict='update'))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
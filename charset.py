@@ -20,5 +20,5 @@ class Converter:
                 return f(data, codec)
             except UnicodeError:
                 continue
-        Log.e('charset detection failed (in list: [' + str.join(',', charset_order) + '] )')
+        Log.e('charset detection failed (in list: [%s] )', lambda: str.join(',', charset_order))
         return None
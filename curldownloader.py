@@ -1,65 +1,1116 @@
+import asyncio
+import email.utils
+import hashlib
 import io
+import json
+import math
+import mmap
+import os
 import pycurl
+import threading
 import time
-from urllib.parse import urlencode
-from collections import Iterable
+from collections import deque
+from typing import Callable, Iterable, Iterator, Tuple, Union
+from urllib.parse import urlencode, urlsplit
 
 import certifi
 
+from .log import Log
+
+
+_HTTP2 = bool(pycurl.version_info()[4] & pycurl.VERSION_HTTP2)
+_TIMINGS = (
+    ('name_lookup', pycurl.NAMELOOKUP_TIME),
+    ('connect', pycurl.CONNECT_TIME),
+    ('app_connect', pycurl.APPCONNECT_TIME),
+    ('start_transfer', pycurl.STARTTRANSFER_TIME),
+    ('total', pycurl.TOTAL_TIME),
+)
+
+
+def _configure(curl: pycurl.Curl):
+    curl.setopt(pycurl.CAINFO, certifi.where())
+    # '' offers every encoding libcurl was built with (gzip, deflate, br, zstd) and decodes the body transparently
+    curl.setopt(pycurl.ACCEPT_ENCODING, '')
+    if _HTTP2:
+        curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2TLS)
+
+
+def _timings_of(curl: pycurl.Curl) -> dict:
+    return {name: curl.getinfo(info) for name, info in _TIMINGS}
+
+
+class HTTPHeaders(dict):
+    """
+    Headers of one response. Names are stored lower-case and looked up case-insensitively; a repeated header is
+    joined with ', '. ``status_line`` is the response's first line (e.g. 'HTTP/2 200').
+    """
+    __slots__ = ('status_line', )
+
+    def __init__(self, status_line: str = ''):
+        super().__init__()
+        self.status_line = status_line
+
+    def add(self, name: str, value: str):
+        name = name.strip().lower()
+        value = value.strip()
+        existing = dict.get(self, name)
+        dict.__setitem__(self, name, value if existing is None else existing + ', ' + value)
+
+    def __getitem__(self, name: str) -> str:
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and dict.__contains__(self, name.lower())
+
+    def get(self, name: str, default=None):
+        return dict.get(self, name.lower(), default)
+
+    def get_status_code(self) -> int:
+        parts = self.status_line.split(None, 2)
+        return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+
 
 class HTTPResult:
-    def __init__(self, status_code: int, body_buffer: io.BufferedIOBase, heads: tuple = None):
+    def __init__(self, status_code: int, body_buffer: io.BufferedIOBase, heads: Union[tuple, bytes] = None,
+                 error: str = None, timings: dict = None):
         self._status_code = status_code
         self._body_buffer = body_buffer
-        self._heads = heads
+        # raw head bytes from curl are only decoded / split when asked for
+        self._raw_heads = heads if isinstance(heads, bytes) else None
+        self._heads = None if self._raw_heads is not None else heads
+        self._hops = None
+        self._error = error
+        self._timings = timings
 
     def get_status_code(self) -> int:
         return self._status_code
 
     def get_body(self) -> io.BufferedIOBase:
+        if isinstance(self._body_buffer, memoryview):
+            return io.BytesIO(self._body_buffer)  # copies; use get_body_view() to avoid it
         return self._body_buffer
 
+    def get_body_view(self) -> memoryview:
+        """The body without copying it: the in-memory buffer, the caller's sink, or a read-only map of the file."""
+        body = self._body_buffer
+        if isinstance(body, memoryview):
+            return body
+        if isinstance(body, io.BytesIO):
+            return body.getbuffer()
+        if self.get_body_size() == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(body.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_body_size(self) -> int:
+        body = self._body_buffer
+        if body is None:
+            return 0
+        if isinstance(body, memoryview):
+            return body.nbytes
+        if isinstance(body, io.BytesIO):
+            return body.getbuffer().nbytes
+        return os.fstat(body.fileno()).st_size
+
     def get_head(self) -> tuple:
+        """Every header line of every response hop (redirects, 100 Continue), status lines included."""
+        if self._heads is None and self._raw_heads is not None:
+            # iso-8859-1 maps every byte, so a stray non-ASCII header can't break decoding
+            self._heads = tuple(h for h in self._raw_heads.decode('iso-8859-1').split('\r\n') if h)
         return self._heads
 
+    def get_hops(self) -> tuple:
+        """``HTTPHeaders`` of each response hop in order; the last one is the final response."""
+        if self._hops is None:
+            self._hops = _parse_hops(self.get_head())
+        return self._hops
+
+    def get_headers(self) -> HTTPHeaders:
+        """Headers of the final response (after any redirects)."""
+        hops = self.get_hops()
+        return hops[-1] if hops else HTTPHeaders()
+
+    def get_timings(self) -> dict:
+        """
+        Seconds from the start of the transfer until name_lookup / connect / app_connect (TLS done) /
+        start_transfer (first byte) / total, as reported by curl. Empty if the result did not come from the network.
+        """
+        return self._timings or {}
+
+    def get_error(self) -> str:
+        """curl error message if the transfer itself failed (only set by MultiCurlDownloader), else None"""
+        return self._error
+
+
+def _parse_hops(heads: tuple) -> tuple:
+    hops = []
+    for head in heads or ():
+        if head.startswith('HTTP/'):
+            hops.append(HTTPHeaders(head))
+            continue
+        name, sep, value = head.partition(':')
+        if sep:
+            if not hops:
+                hops.append(HTTPHeaders())
+            hops[-1].add(name, value)
+    return tuple(hops)
+
+
+class _BodySink:
+    """
+    WRITEFUNCTION target for ``CurlDownloader.download``: a file path, any writable object, or a
+    bytearray / writable memoryview that is filled in place. Writing past ``max_size`` (or past the end of a
+    memoryview) aborts the transfer.
+    """
+
+    def __init__(self, target, max_size: int = 0):
+        self.size = 0
+        self.body = None
+        self._max_size = max_size
+        self._path = None
+        self._view = None
+        self._write = None
+        if isinstance(target, str):
+            self._path = target
+            self.body = open(target, 'w+b')
+            self._write = self.body.write
+        elif isinstance(target, (bytearray, memoryview)):
+            self._view = memoryview(target).cast('B')
+        else:
+            self.body = target
+            self._write = target.write
+
+    def write(self, data: bytes):
+        n = len(data)
+        if self._max_size and self.size + n > self._max_size:
+            return 0  # curl treats a short write as an error and stops
+        if self._view is not None:
+            if self.size + n > len(self._view):
+                return 0
+            self._view[self.size:self.size + n] = data
+        else:
+            self._write(data)
+        self.size += n
+
+    def finish(self):
+        if self._view is not None:
+            self.body = self._view[:self.size]
+        elif self._path is not None:
+            self.body.flush()
+            self.body.seek(0)
+
+    def discard(self):
+        if self._path is not None:
+            self.body.close()
+            os.remove(self._path)
+
+
+class _RangePart:
+    """One byte range ``[pos, end)`` of ``CurlDownloader.download_to`` (``end`` None: the whole body, no Range)."""
+    __slots__ = ('pos', 'end', 'attempt', 'retry_at', 'status', 'started', 'file', 'curl')
+
+    def __init__(self, pos: int, end: int = None):
+        self.pos = pos
+        self.end = end
+        self.attempt = 0
+        self.retry_at = 0.0
+        self.status = 0
+        self.started = False
+        self.file = None
+        self.curl = None
+
+    def head(self, line: bytes):
+        # getinfo() can't be called from inside a transfer, so the status comes from the status line
+        if line.startswith(b'HTTP/'):
+            parts = line.split(None, 2)
+            self.status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+            self.started = False
+
+    def write(self, data: bytes):
+        if not self.started:
+            if self.status != (200 if self.end is None else 206):
+                return 0
+            self.started = True
+            if self.end is None and self.pos:  # restarting a transfer that can't be resumed
+                self.file.seek(0)
+                self.file.truncate()
+                self.pos = 0
+        if self.end is not None and self.pos + len(data) > self.end:
+            return 0
+        self.file.write(data)
+        self.pos += len(data)
+
+
+class HTTPStream(HTTPResult):
+    """
+    Response whose body is read chunk by chunk with ``iter_content()``; status code and head are available as soon
+    as the stream is returned. At most a few chunks are buffered: the transfer is paused while the consumer lags.
+    """
+    _MAX_BUFFERED_CHUNKS = 4
+
+    def __init__(self, url: str, chunk_size: int = 65536, max_size: int = 0):
+        super().__init__(0, None, ())
+        self._chunks = deque()
+        self._size = 0
+        self._max_size = max_size
+        self._paused = False
+        self._done = False
+        self._errno = 0
+        self._head_buffer = io.BytesIO()
+        self._curl = pycurl.Curl()
+        self._curl.setopt(pycurl.URL, url)
+        _configure(self._curl)
+        self._curl.setopt(pycurl.BUFFERSIZE, chunk_size)
+        self._curl.setopt(pycurl.WRITEFUNCTION, self._on_data)
+        self._curl.setopt(pycurl.HEADERFUNCTION, self._head_buffer.write)
+        if max_size:
+            self._curl.setopt(pycurl.MAXFILESIZE_LARGE, max_size)
+        self._multi = pycurl.CurlMulti()
+        self._multi.add_handle(self._curl)
+        # body data only arrives after the complete head
+        while not self._chunks and not self._done:
+            self._pump()
+        self._status_code = self._curl.getinfo(pycurl.RESPONSE_CODE)
+        self._raw_heads = self._head_buffer.getvalue()
+        self._heads = None
+
+    def _on_data(self, data: bytes):
+        if len(self._chunks) >= self._MAX_BUFFERED_CHUNKS:
+            self._paused = True
+            return pycurl.WRITEFUNC_PAUSE  # curl keeps the data and hands it over again after unpausing
+        if self._max_size and self._size + len(data) > self._max_size:
+            return 0
+        self._chunks.append(data)
+        self._size += len(data)
+
+    def _pump(self):
+        while self._multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+            pass
+        n_queued, ok_list, err_list = self._multi.info_read()
+        if ok_list or err_list:
+            self._done = True
+            if err_list:
+                self._errno, self._error = err_list[0][1], err_list[0][2]
+        elif not self._chunks:
+            timeout = self._multi.timeout()
+            self._multi.select(1.0 if timeout < 0 else min(timeout / 1000.0, 1.0))
+
+    def iter_content(self) -> Iterator[bytes]:
+        """Yields the body in chunks of at most ``chunk_size`` bytes; raises ``pycurl.error`` if the transfer fails."""
+        try:
+            while True:
+                while self._chunks:
+                    yield self._chunks.popleft()
+                if self._done:
+                    break
+                if self._paused:
+                    self._paused = False
+                    self._curl.pause(pycurl.PAUSE_CONT)
+                    if self._chunks:
+                        continue
+                self._pump()
+            if self._errno:
+                raise pycurl.error(self._errno, self._error)
+        finally:
+            self.close()
+
+    def get_body_size(self) -> int:
+        return self._size
+
+    def get_timings(self) -> dict:
+        """As ``HTTPResult.get_timings``; 'total' is only final once the body has been consumed."""
+        if self._multi is not None:
+            return _timings_of(self._curl)
+        return self._timings or {}
+
+    def close(self):
+        if self._multi is not None:
+            self._timings = _timings_of(self._curl)
+            self._multi.remove_handle(self._curl)
+            self._multi.close()
+            self._curl.close()
+            self._multi = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+class _ResourceChanged(Exception):
+    """A range sent with If-Range was answered with the whole body: the resource changed."""
+
+
+class _RangesIgnored(Exception):
+    """A range sent without If-Range was answered with the whole body: the server ignores Range on GET."""
+
+
+# download_to persists its progress after roughly this many bytes, so even a killed process can resume
+_CHECKPOINT_BYTES = 4 << 20
+
+
+def _save_ranges(state_path: str, length: int, validator: str, ranges: list):
+    # written aside and renamed, so a crash leaves either the old or the new state
+    tmp = state_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'length': length, 'validator': validator, 'ranges': [[r.pos, r.end] for r in ranges]}, f)
+    os.replace(tmp, state_path)
+
+
+def _host_of(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+class HostScheduler:
+    """
+    Per-host politeness shared by the downloaders. For every host (``host[:port]``) independently:
+
+    - token bucket: one request per ``min_delay`` seconds, up to ``burst`` back to back
+    - at most ``max_concurrency`` requests in flight
+    - after a 429/503 the host cools down for ``Retry-After`` if the server sent one, otherwise for
+      ``backoff_base * 2 ** (failures - 1)`` seconds, capped at ``max_backoff``
+
+    A host that is cooling down never holds back requests to other hosts.
+    """
+    _RETRY_STATUS = (429, 503)
+
+    class _Host:
+        __slots__ = ('tokens', 'updated', 'active', 'blocked_until', 'failures')
+
+        def __init__(self, tokens: float, now: float):
+            self.tokens = tokens
+            self.updated = now
+            self.active = 0
+            self.blocked_until = 0.0
+            self.failures = 0
+
+    def __init__(self, min_delay: float = 0.0, max_concurrency: int = 2, burst: int = 1,
+                 backoff_base: float = 1.0, max_backoff: float = 300.0):
+        self._min_delay = min_delay
+        self._max_concurrency = max(1, max_concurrency)
+        self._burst = max(1, burst)
+        self._backoff_base = backoff_base
+        self._max_backoff = max_backoff
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def try_acquire(self, host: str) -> float:
+        """Reserve a slot for ``host`` and return 0, or return the seconds to wait (``math.inf``: until a release)."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = HostScheduler._Host(self._burst, now)
+            if state.blocked_until > now:
+                return state.blocked_until - now
+            if state.active >= self._max_concurrency:
+                return math.inf
+            if self._min_delay > 0:
+                state.tokens = min(self._burst, state.tokens + (now - state.updated) / self._min_delay)
+                state.updated = now
+                if state.tokens < 1:
+                    return (1 - state.tokens) * self._min_delay
+                state.tokens -= 1
+            state.active += 1
+            return 0.0
+
+    def acquire(self, host: str):
+        """Blocking ``try_acquire``."""
+        while True:
+            wait = self.try_acquire(host)
+            if wait == 0:
+                return
+            with self._released:
+                self._released.wait(None if wait == math.inf else wait)
+
+    async def acquire_async(self, host: str):
+        while True:
+            wait = self.try_acquire(host)
+            if wait == 0:
+                return
+            await asyncio.sleep(0.01 if wait == math.inf else wait)
+
+    def release(self, host: str, status_code: int = 0, heads: Union[tuple, HTTPResult] = ()):
+        """
+        Give the slot back; a 429/503 ``status_code`` starts the host's cool-down. ``heads`` (a head tuple or the
+        ``HTTPResult`` itself) is only read for its Retry-After header in that case.
+        """
+        with self._lock:
+            state = self._hosts[host]
+            state.active -= 1
+            if status_code in self._RETRY_STATUS:
+                state.failures += 1
+                delay = _retry_after(heads.get_head() if isinstance(heads, HTTPResult) else heads)
+                if delay is None:
+                    delay = min(self._max_backoff, self._backoff_base * 2 ** (state.failures - 1))
+                state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+            elif status_code:
+                state.failures = 0
+            self._released.notify_all()
+
+    def is_retry_status(self, status_code: int) -> bool:
+        return status_code in self._RETRY_STATUS
+
+
+def _retry_after(heads: tuple):
+    """Seconds from the last ``Retry-After`` header (delta-seconds or HTTP-date), or None."""
+    value = None
+    for head in heads or ():
+        name, sep, v = head.partition(':')
+        if sep and name.strip().lower() == 'retry-after':
+            value = v.strip()
+    if value is None:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
 
 class CurlDownloader:
     def __init__(self):
-        self._wait_secs = 0
+        self._scheduler = None
+        self._cache = None
         self._curl = pycurl.Curl()
+        _configure(self._curl)
         self._cache_body = None
         self._cache_head = None
         self._heads = None
 
     def _prep(self):
+        # the handle is shared by every request method: undo what post() left behind (HTTPGET also stops
+        # the POSTFIELDS from being sent; pycurl can't unset them)
+        self._curl.setopt(pycurl.HTTPGET, True)
+        self._curl.unsetopt(pycurl.CUSTOMREQUEST)
         self._cache_body = io.BytesIO()
         self._cache_head = io.BytesIO()
-        self._curl.setopt(pycurl.CAINFO, certifi.where())
         self._curl.setopt(pycurl.WRITEFUNCTION, self._cache_body.write)
         self._curl.setopt(pycurl.HEADERFUNCTION, self._cache_head.write)
-        time.sleep(self._wait_secs)
 
-    def _perform(self) -> HTTPResult:
+    def _perform(self, url: str) -> HTTPResult:
+        if self._scheduler is None:
+            return self._perform_now()
+        host = _host_of(url)
+        self._scheduler.acquire(host)
+        result = None
+        try:
+            result = self._perform_now()
+        finally:
+            if result is None:
+                self._scheduler.release(host)
+            else:
+                self._scheduler.release(host, result.get_status_code(), result)
+        return result
+
+    def _perform_now(self) -> HTTPResult:
         self._curl.perform()
-        self._cache_body.seek(0)
+        if self._cache_body is not None:
+            self._cache_body.seek(0)
         self._cache_head.seek(0)
-        _headers = []
-        for _item in self._cache_head.read().decode('ascii').split('\r\n'):
-            if _item:
-                _headers.append(_item)
-        return HTTPResult(self._curl.getinfo(pycurl.HTTP_CODE), self._cache_body, tuple(_headers))
+        return HTTPResult(self._curl.getinfo(pycurl.HTTP_CODE), self._cache_body, self._cache_head.getvalue(),
+                          timings=_timings_of(self._curl))
 
+    @Log.timer('CurlDownloader.get')
     def get(self, url: str) -> HTTPResult:
+        if self._cache is not None:
+            return self._get_cached(url)
+        self._prep()
+        self._curl.setopt(pycurl.URL, url)
+        return self._perform(url)
+
+    def _get_cached(self, url: str) -> HTTPResult:
+        entry = self._cache.lookup(url)
+        if entry is not None and entry.is_fresh():
+            return self._cache.hit(entry)
         self._prep()
         self._curl.setopt(pycurl.URL, url)
-        return self._perform()
+        if entry is not None:
+            self._curl.setopt(pycurl.HTTPHEADER, entry.get_validators())
+        try:
+            result = self._perform(url)
+        finally:
+            if entry is not None:
+                self._curl.unsetopt(pycurl.HTTPHEADER)  # setopt(..., []) would keep the validators
+        if entry is not None and result.get_status_code() == 304:
+            return self._cache.revalidated(entry, result)
+        self._cache.miss()
+        self._cache.store(url, result)
+        return result
 
+    def set_cache(self, cache: 'HTTPCache'):
+        """Serve ``get`` from ``cache`` (see ``httpcache.HTTPCache``) when allowed; ``None`` turns it off."""
+        self._cache = cache
+
+    @Log.timer('CurlDownloader.post')
     def post(self, url: str, data: Iterable) -> HTTPResult:
         self._prep()
         self._curl.setopt(pycurl.URL, url)
         self._curl.setopt(pycurl.CUSTOMREQUEST, 'POST')
         self._curl.setopt(pycurl.POSTFIELDS, urlencode(data))
-        return self._perform()
+        return self._perform(url)
+
+    @Log.timer('CurlDownloader.download')
+    def download(self, url: str, sink: Union[str, io.RawIOBase, bytearray, memoryview],
+                 max_size: int = 0) -> HTTPResult:
+        """
+        GET ``url`` without holding the body in memory. ``sink`` is a file path (the result body is that file,
+        rewound), any object with ``write``, or a bytearray / writable memoryview filled in place (the result body
+        view is the filled part). More than ``max_size`` bytes (0: no cap) aborts with ``pycurl.error``; a
+        partially written file is removed.
+        """
+        self._prep()
+        body = _BodySink(sink, max_size)
+        self._curl.setopt(pycurl.URL, url)
+        self._curl.setopt(pycurl.WRITEFUNCTION, body.write)
+        self._curl.setopt(pycurl.MAXFILESIZE_LARGE, max_size)
+        self._cache_body = None
+        try:
+            result = self._perform(url)
+        except pycurl.error:
+            body.discard()
+            raise
+        finally:
+            self._curl.setopt(pycurl.MAXFILESIZE_LARGE, 0)
+        body.finish()
+        return HTTPResult(result.get_status_code(), body.body, self._cache_head.getvalue(),
+                          timings=result.get_timings())
+
+    @Log.timer('CurlDownloader.download_to')
+    def download_to(self, url: str, path: str, parts: int = 1, checksum: Tuple[str, str] = None, retries: int = 3,
+                    min_part_size: int = 1 << 20) -> HTTPResult:
+        """
+        Download ``url`` to ``path``, resuming where an earlier attempt stopped. Data goes to ``path + '.part'``
+        (progress in ``path + '.part.json'``) and is renamed to ``path`` once complete. If the server accepts byte
+        ranges, a dropped connection or a new call continues from the last byte written (``If-Range`` makes sure
+        the resource hasn't changed), and with ``parts`` > 1 the preallocated file is fetched as that many
+        concurrent ranges of at least ``min_part_size`` bytes. Otherwise the body is fetched in one piece.
+        Each range is retried up to ``retries`` times. The size must match Content-Length and, if given, the
+        digest ``checksum=(hashlib algorithm, hex digest)``; a mismatch removes the partial file and raises
+        ``ValueError``. An error status from the server is returned without downloading anything.
+        """
+        host = _host_of(url)
+        if self._scheduler is not None:
+            self._scheduler.acquire(host)
+        try:
+            return self._download_to(url, path, max(1, parts), checksum, retries, min_part_size, False, True)
+        finally:
+            if self._scheduler is not None:
+                self._scheduler.release(host)
+
+    def _download_to(self, url: str, path: str, parts: int, checksum: Tuple[str, str], retries: int,
+                     min_part_size: int, restarted: bool, ranged: bool) -> HTTPResult:
+        part_path = path + '.part'
+        state_path = part_path + '.json'
+        probe, url, length, validator = self._probe(url)
+        if probe.get_status_code() >= 400 and probe.get_status_code() not in (405, 501):  # HEAD may be unsupported
+            return probe
+        if not ranged:  # fetched in one piece, as if the server didn't advertise ranges
+            length = None
+        state = None
+        if length is not None and os.path.exists(part_path) and os.path.exists(state_path):
+            try:
+                with open(state_path, 'r') as f:
+                    state = json.load(f)
+            except ValueError:
+                state = {}
+            if state.get('length') != length or state.get('validator') != validator:
+                state = None
+        if state is not None:
+            ranges = [_RangePart(pos, end) for pos, end in state['ranges']]
+        else:
+            if length is None:
+                ranges = [_RangePart(0)]
+            else:
+                n = max(1, min(parts, length // max(1, min_part_size)))
+                bounds = [length * i // n for i in range(n + 1)]
+                ranges = [_RangePart(bounds[i], bounds[i + 1]) for i in range(n)]
+                _save_ranges(state_path, length, validator, ranges)
+            with open(part_path, 'wb') as f:
+                if length:
+                    if hasattr(os, 'posix_fallocate'):
+                        os.posix_fallocate(f.fileno(), 0, length)
+                    else:
+                        f.truncate(length)
+        restart = None
+        try:
+            checkpoint = None
+            if length is not None:
+                checkpoint = lambda: _save_ranges(state_path, length, validator, [r for r in ranges if r.pos < r.end])
+            self._fetch_ranges(url, part_path, ranges, validator, retries, checkpoint)
+        except (_ResourceChanged, _RangesIgnored) as e:
+            restart = e
+        finally:
+            if length is not None and restart is None:
+                _save_ranges(state_path, length, validator, [r for r in ranges if r.pos < r.end])
+        if restart is not None:
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            # start over with ranges at most once; after that (or if ranges aren't honoured) take the whole body
+            if isinstance(restart, _ResourceChanged) and not restarted:
+                Log.w('%s changed since the partial download, starting over', url)
+                return self._download_to(url, path, parts, checksum, retries, min_part_size, True, True)
+            Log.w('%s kept answering ranges with the whole body, downloading it in one piece', url)
+            return self._download_to(url, path, parts, checksum, retries, min_part_size, True, False)
+        size = os.path.getsize(part_path)
+        error = None
+        if length is not None and size != length:
+            error = 'size %d does not match Content-Length %d' % (size, length)
+        elif checksum is not None:
+            digest = hashlib.new(checksum[0])
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            if digest.hexdigest() != checksum[1].lower():
+                error = '%s digest %s does not match %s' % (checksum[0], digest.hexdigest(), checksum[1])
+        if error is not None:
+            os.remove(part_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            raise ValueError('download of %s failed verification: %s' % (url, error))
+        os.replace(part_path, path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return HTTPResult(200, open(path, 'rb'), probe.get_head())
+
+    def _probe(self, url: str) -> tuple:
+        """HEAD ``url`` (following redirects): the result, final url, byte length if ranges work, and a validator."""
+        curl = pycurl.Curl()
+        head = io.BytesIO()
+        try:
+            _configure(curl)
+            curl.setopt(pycurl.ACCEPT_ENCODING, None)  # ranges are over the identity encoding
+            curl.setopt(pycurl.URL, url)
+            curl.setopt(pycurl.NOBODY, True)
+            curl.setopt(pycurl.FOLLOWLOCATION, True)
+            curl.setopt(pycurl.HEADERFUNCTION, head.write)
+            curl.perform()
+            probe = HTTPResult(curl.getinfo(pycurl.RESPONSE_CODE), None, head.getvalue(), timings=_timings_of(curl))
+            url = curl.getinfo(pycurl.EFFECTIVE_URL)
+        finally:
+            curl.close()
+        headers = probe.get_headers()
+        length = headers.get('content-length', '')
+        if probe.get_status_code() != 200 or not length.isdigit() or 'bytes' not in headers.get('accept-ranges', ''):
+            length = None
+        else:
+            length = int(length)
+        validator = headers.get('etag')
+        if validator is None or validator.startswith('W/'):  # If-Range needs a strong validator
+            validator = headers.get('last-modified')
+        return probe, url, length, validator
+
+    @staticmethod
+    def _fetch_ranges(url: str, part_path: str, ranges: list, validator: str, retries: int,
+                      checkpoint: Callable[[], None] = None):
+        multi = pycurl.CurlMulti()
+        waiting = [r for r in ranges if r.end is None or r.pos < r.end]
+        active = 0
+        saved = sum(r.pos for r in ranges)
+        try:
+            while waiting or active:
+                now = time.monotonic()
+                for part in [r for r in waiting if r.retry_at <= now]:
+                    waiting.remove(part)
+                    part.status = 0
+                    part.started = False
+                    part.file = open(part_path, 'r+b')
+                    part.file.seek(part.pos)
+                    part.curl = pycurl.Curl()
+                    _configure(part.curl)
+                    part.curl.setopt(pycurl.ACCEPT_ENCODING, None)
+                    part.curl.setopt(pycurl.URL, url)
+                    part.curl.setopt(pycurl.WRITEFUNCTION, part.write)
+                    part.curl.setopt(pycurl.HEADERFUNCTION, part.head)
+                    if part.end is not None:
+                        part.curl.setopt(pycurl.RANGE, '%d-%d' % (part.pos, part.end - 1))
+                        if validator is not None:
+                            part.curl.setopt(pycurl.HTTPHEADER, ['If-Range: ' + validator])
+                    part.curl.part = part
+                    multi.add_handle(part.curl)
+                    active += 1
+                while multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+                    pass
+                while True:
+                    n_queued, ok_list, err_list = multi.info_read()
+                    for curl, error in [(c, None) for c in ok_list] + [(c, m) for c, e, m in err_list]:
+                        part = curl.part
+                        part.status = part.status or curl.getinfo(pycurl.RESPONSE_CODE)
+                        multi.remove_handle(curl)
+                        curl.close()
+                        part.file.close()
+                        part.curl = part.file = None
+                        active -= 1
+                        if part.end is not None and part.status == 200:
+                            raise _ResourceChanged() if validator is not None else _RangesIgnored()
+                        if 400 <= part.status < 500:
+                            raise pycurl.error(pycurl.E_HTTP_RETURNED_ERROR, 'HTTP %d from %s' % (part.status, url))
+                        if error is None and part.status in (200, 206) and (part.end is None or part.pos == part.end):
+                            continue
+                        if part.attempt >= retries:
+                            raise pycurl.error(pycurl.E_PARTIAL_FILE, error or 'range ended early at %d' % part.pos)
+                        part.attempt += 1
+                        part.retry_at = time.monotonic() + min(30.0, 0.5 * 2 ** (part.attempt - 1))
+                        Log.w('retrying %s from byte %d (%s)', url, part.pos, error or 'ended early')
+                        waiting.append(part)
+                    if n_queued == 0:
+                        break
+                if checkpoint is not None and sum(r.pos for r in ranges) - saved >= _CHECKPOINT_BYTES:
+                    # the state must never claim bytes that are still in a buffer
+                    for part in ranges:
+                        if part.file is not None:
+                            part.file.flush()
+                            os.fsync(part.file.fileno())
+                    checkpoint()
+                    saved = sum(r.pos for r in ranges)
+                if active:
+                    multi.select(1.0)
+                elif waiting:
+                    time.sleep(max(0.0, min(r.retry_at for r in waiting) - time.monotonic()))
+        finally:
+            for part in ranges:
+                if part.curl is not None:
+                    multi.remove_handle(part.curl)
+                    part.curl.close()
+                    part.file.close()
+                    part.curl = part.file = None
+            multi.close()
+
+    def stream(self, url: str, chunk_size: int = 65536, max_size: int = 0) -> HTTPStream:
+        """GET ``url`` as an ``HTTPStream``; iterate ``iter_content()`` to consume the body."""
+        return HTTPStream(url, chunk_size, max_size)
+
+    def implicitly_wait(self, sec: int):
+        """Keep at least ``sec`` seconds between two requests to the same host; other hosts are not delayed."""
+        self.set_scheduler(HostScheduler(min_delay=sec, max_concurrency=1) if sec else None)
+
+    def set_scheduler(self, scheduler: HostScheduler):
+        self._scheduler = scheduler
+
+    def get_many(self, urls: Iterable[str], concurrency: int = 10, max_per_host: int = 2,
+                 callback: Callable[[str, HTTPResult], None] = None) -> Iterator[Tuple[str, HTTPResult]]:
+        """Fetch ``urls`` concurrently; see ``MultiCurlDownloader.get_many``. Shares this downloader's scheduler."""
+        return MultiCurlDownloader(concurrency, max_per_host, self._scheduler).get_many(urls, callback)
+
+
+class MultiCurlDownloader:
+    """
+    Concurrent GETs on one ``pycurl.CurlMulti``. A fixed pool of ``concurrency`` easy handles is reused, so
+    connections stay alive between requests. Per-host limits come from ``scheduler`` (by default at most
+    ``max_per_host`` transfers per host, no delay); a 429/503 answer is retried up to ``retries`` times once the
+    host has cooled down, while other hosts keep going.
+    """
+
+    def __init__(self, concurrency: int = 10, max_per_host: int = 2, scheduler: HostScheduler = None,
+                 retries: int = 2):
+        self._concurrency = max(1, concurrency)
+        self._scheduler = scheduler if scheduler is not None else HostScheduler(max_concurrency=max_per_host)
+        self._retries = retries
+        self._multi = pycurl.CurlMulti()
+        self._handles = []
+        for _ in range(self._concurrency):
+            curl = pycurl.Curl()
+            _configure(curl)
+            curl.setopt(pycurl.FOLLOWLOCATION, False)
+            curl.setopt(pycurl.PIPEWAIT, 1)  # prefer multiplexing on an existing HTTP/2 connection
+            self._handles.append(curl)
+
+    def get_many(self, urls: Iterable[str],
+                 callback: Callable[[str, HTTPResult], None] = None) -> Iterator[Tuple[str, HTTPResult]]:
+        """
+        Yields ``(url, HTTPResult)`` in completion order; ``callback(url, result)`` is called for each as well.
+        A failed transfer yields status code 0 and ``HTTPResult.get_error()`` set.
+        """
+        source = iter(urls)
+        source_done = False
+        waiting = {}  # host -> deque of (url, attempt) held back by the scheduler
+        n_waiting = 0
+        free = list(self._handles)
+        multi = self._multi
+        scheduler = self._scheduler
+        next_wait = math.inf  # seconds until a held-back host may be tried again
+
+        def hold(host: str, url: str, attempt: int):
+            nonlocal n_waiting
+            waiting.setdefault(host, deque()).append((url, attempt))
+            n_waiting += 1
+
+        def next_url():
+            nonlocal source_done, n_waiting, next_wait
+            next_wait = math.inf
+            for host, queue in waiting.items():
+                wait = scheduler.try_acquire(host)
+                if wait == 0:
+                    url, attempt = queue.popleft()
+                    if not queue:
+                        del waiting[host]
+                    n_waiting -= 1
+                    return host, url, attempt
+                next_wait = min(next_wait, wait)
+            # don't buffer more than a few rounds worth of held-back urls
+            while not source_done and n_waiting < 16 * self._concurrency:
+                url = next(source, None)
+                if url is None:
+                    source_done = True
+                    break
+                host = _host_of(url)
+                if host not in waiting:
+                    wait = scheduler.try_acquire(host)
+                    if wait == 0:
+                        return host, url, 0
+                    next_wait = min(next_wait, wait)
+                hold(host, url, 0)
+            return None
+
+        def start(curl: pycurl.Curl, host: str, url: str, attempt: int):
+            curl.body = io.BytesIO()
+            curl.head = io.BytesIO()
+            curl.host = host
+            curl.url = url
+            curl.attempt = attempt
+            curl.setopt(pycurl.URL, url)
+            curl.setopt(pycurl.WRITEFUNCTION, curl.body.write)
+            curl.setopt(pycurl.HEADERFUNCTION, curl.head.write)
+            multi.add_handle(curl)
+
+        def finish(curl: pycurl.Curl, error: str = None) -> Tuple[str, HTTPResult]:
+            multi.remove_handle(curl)
+            free.append(curl)
+            curl.body.seek(0)
+            status = 0 if error is not None else curl.getinfo(pycurl.HTTP_CODE)
+            result = HTTPResult(status, curl.body, curl.head.getvalue(), error, _timings_of(curl))
+            scheduler.release(curl.host, status, result)
+            url = curl.url
+            if scheduler.is_retry_status(status) and curl.attempt < self._retries:
+                hold(curl.host, url, curl.attempt + 1)
+                result = None
+            curl.body = curl.head = None
+            return url, result
+
+        try:
+            while True:
+                while free:
+                    item = next_url()
+                    if item is None:
+                        break
+                    start(free.pop(), *item)
+                if len(free) == len(self._handles):
+                    if not n_waiting and source_done:
+                        return
+                    # every pending host is cooling down
+                    time.sleep(min(next_wait, 1.0))
+                    continue
+                while multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+                    pass
+                finished = False
+                while True:
+                    n_queued, ok_list, err_list = multi.info_read()
+                    done = [finish(c) for c in ok_list] + [finish(c, msg) for c, errno, msg in err_list]
+                    for url, result in done:
+                        finished = True
+                        if result is None:  # requeued for a retry
+                            continue
+                        if callback is not None:
+                            callback(url, result)
+                        yield url, result
+                    if n_queued == 0:
+                        break
+                if not finished:
+                    # libcurl tells how long it can wait (e.g. 0 right after a handle was added)
+                    timeout = multi.timeout()
+                    timeout = 1.0 if timeout < 0 else timeout / 1000.0
+                    multi.select(min(timeout, next_wait, 1.0))
+        finally:
+            # the caller may stop iterating early; detach whatever is still running
+            for curl in self._handles:
+                if curl not in free:
+                    multi.remove_handle(curl)
+                    scheduler.release(curl.host)
+
+    def close(self):
+        for curl in self._handles:
+            curl.close()
+        self._multi.close()
+
+
+class AsyncCurlDownloader:
+    """
+    ``await get()/post()`` for asyncio code. All transfers share one ``CurlMulti`` that is driven by the running
+    event loop through libcurl's socket and timer callbacks, so no thread is used and the loop is never blocked.
+    While no transfer is in flight, the downloader moves to whichever loop uses it next (e.g. successive
+    ``asyncio.run`` calls); a loop starting a transfer while another loop has one in flight gets a RuntimeError.
+    """
+
+    def __init__(self, max_idle_handles: int = 16, scheduler: HostScheduler = None):
+        self._scheduler = scheduler
+        self._max_idle_handles = max_idle_handles
+        self._idle = []
+        self._futures = {}  # Curl -> Future
+        self._loop = None
+        self._timer = None
+        self._fds = {}  # fd -> libcurl POLL_* mask being watched on self._loop
+        self._multi = pycurl.CurlMulti()
+        self._multi.setopt(pycurl.M_SOCKETFUNCTION, self._on_socket)
+        self._multi.setopt(pycurl.M_TIMERFUNCTION, self._on_timer)
+
+    def _on_socket(self, what: int, fd: int, multi, socketp):
+        if fd in self._fds:
+            self._unwatch(fd)
+            del self._fds[fd]
+        if what != pycurl.POLL_REMOVE:
+            self._watch(fd, what)
+            self._fds[fd] = what
+
+    def _watch(self, fd: int, what: int):
+        if what in (pycurl.POLL_IN, pycurl.POLL_INOUT):
+            self._loop.add_reader(fd, self._on_ready, fd, pycurl.CSELECT_IN)
+        if what in (pycurl.POLL_OUT, pycurl.POLL_INOUT):
+            self._loop.add_writer(fd, self._on_ready, fd, pycurl.CSELECT_OUT)
+
+    def _unwatch(self, fd: int):
+        if not self._loop.is_closed():  # a finished asyncio.run closes its loop along with our registrations
+            self._loop.remove_reader(fd)
+            self._loop.remove_writer(fd)
+
+    def _bind(self, loop: asyncio.AbstractEventLoop):
+        """Move the sockets and the pending timeout libcurl asked for over to ``loop``."""
+        had_timer = self._timer is not None
+        if had_timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._loop is not None:
+            for fd in self._fds:
+                self._unwatch(fd)
+        self._loop = loop
+        for fd, what in self._fds.items():
+            self._watch(fd, what)
+        if had_timer:
+            self._timer = loop.call_soon(self._on_ready, pycurl.SOCKET_TIMEOUT, 0)
+
+    def _on_timer(self, timeout_ms: int):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if timeout_ms >= 0:
+            # socket_action must not be called from inside a libcurl callback, so always go through the loop
+            self._timer = self._loop.call_later(timeout_ms / 1000.0, self._on_ready, pycurl.SOCKET_TIMEOUT, 0)
+
+    def _on_ready(self, fd: int, event: int):
+        if fd == pycurl.SOCKET_TIMEOUT:
+            self._timer = None
+        self._multi.socket_action(fd, event)
+        self._check_done()
+
+    def _check_done(self):
+        while True:
+            n_queued, ok_list, err_list = self._multi.info_read()
+            for curl in ok_list:
+                self._finish(curl, None)
+            for curl, errno, msg in err_list:
+                self._finish(curl, pycurl.error(errno, msg))
+            if n_queued == 0:
+                break
+
+    def _finish(self, curl: pycurl.Curl, error):
+        self._multi.remove_handle(curl)
+        future = self._futures.pop(curl)
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                curl.body.seek(0)
+                future.set_result(
+                    HTTPResult(curl.getinfo(pycurl.HTTP_CODE), curl.body, curl.head.getvalue(),
+                               timings=_timings_of(curl))
+                )
+        self._release(curl)
+
+    def _acquire(self) -> pycurl.Curl:
+        curl = self._idle.pop() if self._idle else pycurl.Curl()
+        _configure(curl)
+        curl.setopt(pycurl.PIPEWAIT, 1)
+        curl.body = io.BytesIO()
+        curl.head = io.BytesIO()
+        curl.setopt(pycurl.WRITEFUNCTION, curl.body.write)
+        curl.setopt(pycurl.HEADERFUNCTION, curl.head.write)
+        return curl
+
+    def _release(self, curl: pycurl.Curl):
+        curl.body = curl.head = None
+        if len(self._idle) < self._max_idle_handles:
+            curl.reset()  # keeps the connection cache, clears per-request options
+            self._idle.append(curl)
+        else:
+            curl.close()
+
+    async def _perform(self, curl: pycurl.Curl, url: str) -> HTTPResult:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._futures:
+                self._release(curl)
+                raise RuntimeError('AsyncCurlDownloader has transfers in flight on another event loop')
+            self._bind(loop)
+        if self._scheduler is None:
+            return await self._perform_now(loop, curl)
+        host = _host_of(url)
+        try:
+            await self._scheduler.acquire_async(host)
+        except asyncio.CancelledError:
+            self._release(curl)
+            raise
+        result = None
+        try:
+            result = await self._perform_now(loop, curl)
+        finally:
+            if result is None:
+                self._scheduler.release(host)
+            else:
+                self._scheduler.release(host, result.get_status_code(), result)
+        return result
+
+    async def _perform_now(self, loop: asyncio.AbstractEventLoop, curl: pycurl.Curl) -> HTTPResult:
+        future = loop.create_future()
+        self._futures[curl] = future
+        self._multi.add_handle(curl)
+        try:
+            return await future
+        finally:
+            if self._futures.get(curl) is future:  # cancelled while in flight
+                del self._futures[curl]
+                self._multi.remove_handle(curl)
+                self._release(curl)
+
+    async def get(self, url: str) -> HTTPResult:
+        with Log.timer('AsyncCurlDownloader.get'):
+            curl = self._acquire()
+            curl.setopt(pycurl.URL, url)
+            return await self._perform(curl, url)
+
+    async def post(self, url: str, data: Iterable) -> HTTPResult:
+        with Log.timer('AsyncCurlDownloader.post'):
+            curl = self._acquire()
+            curl.setopt(pycurl.URL, url)
+            curl.setopt(pycurl.POSTFIELDS, urlencode(data))
+            return await self._perform(curl, url)
 
     def implicitly_wait(self, sec: int):
-        self._wait_secs = sec
+        """As ``CurlDownloader.implicitly_wait``, but waiting is an ``asyncio.sleep`` and only delays that host."""
+        self.set_scheduler(HostScheduler(min_delay=sec, max_concurrency=1) if sec else None)
+
+    def set_scheduler(self, scheduler: HostScheduler):
+        self._scheduler = scheduler
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for fd in self._fds:
+            self._unwatch(fd)
+        self._fds.clear()
+        for curl in self._idle:
+            curl.close()
+        self._idle.clear()
+        self._multi.close()
@@ -1,4 +1,4 @@
-from ..curldownloader import CurlDownloader
+from ..curldownloader import CurlDownloader, AsyncCurlDownloader
 from urllib.parse import urlencode
 import json
 
@@ -8,8 +8,9 @@ class GoogleCustomSearch:
         self._API_KEY = api_key
         self._ENGINE_ID = engine_id
         self._downloader = CurlDownloader()
+        self._async_downloader = None
 
-    def exec(self, keyword: str, site: str = ''):
+    def _build_url(self, keyword: str, site: str) -> str:
         _queries = {
             'key': self._API_KEY,
             'cx': self._ENGINE_ID,
@@ -17,5 +18,20 @@ class GoogleCustomSearch:
         }
         if len(site) > 0:
             _queries['q'] += ' site:' + site
-        _url = 'https://www.googleapis.com/customsearch/v1?' + urlencode(_queries)
+        return 'https://www.googleapis.com/customsearch/v1?' + urlencode(_queries)
+
+    def exec(self, keyword: str, site: str = ''):
+        _url = self._build_url(keyword, site)
         return json.loads(self._downloader.get(_url).get_body().read().decode('UTF-8'))
+
+    async def exec_async(self, keyword: str, site: str = ''):
+        # reusable from one asyncio.run to the next; call close() when done
+        if self._async_downloader is None:
+            self._async_downloader = AsyncCurlDownloader()
+        _url = self._build_url(keyword, site)
+        return json.loads((await self._async_downloader.get(_url)).get_body().read().decode('UTF-8'))
+
+    def close(self):
+        if self._async_downloader is not None:
+            self._async_downloader.close()
+            self._async_downloader = None
@@ -0,0 +1,190 @@
+import email.utils
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+from .curldownloader import HTTPResult
+from .log import Log
+from .sqlite3 import SQLite3
+
+# describe one transfer of the body, not the stored (already decoded) representation
+_TRANSFER_HEADERS = ('content-length', 'content-encoding', 'transfer-encoding')
+
+
+class _CacheEntry:
+    __slots__ = ('url', 'digest', 'status_line', 'headers', 'expires_at', 'size')
+
+    def __init__(self, url: str, digest: str, status_line: str, headers: dict, expires_at: float, size: int):
+        self.url = url
+        self.digest = digest
+        self.status_line = status_line
+        self.headers = headers
+        self.expires_at = expires_at
+        self.size = size
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def get_validators(self) -> list:
+        """Request headers for a conditional GET."""
+        validators = []
+        if 'etag' in self.headers:
+            validators.append('If-None-Match: ' + self.headers['etag'])
+        if 'last-modified' in self.headers:
+            validators.append('If-Modified-Since: ' + self.headers['last-modified'])
+        return validators
+
+
+class HTTPCache:
+    """
+    Persistent cache for ``CurlDownloader.get`` (``CurlDownloader.set_cache``). Bodies are stored once per content
+    hash under ``directory/objects``; the index (url -> hash, parsed headers, expiry) is a ``SQLite3`` database.
+    Freshness follows Cache-Control (no-store, no-cache, max-age, s-maxage) and Expires; stale entries with an
+    ETag / Last-Modified are revalidated and a 304 is answered from disk. Least recently used entries are evicted
+    once the stored bodies exceed ``max_bytes``.
+    """
+    _TABLE = 'entries'
+    _COLUMNS = ['url', 'digest', 'status_line', 'headers', 'expires_at', 'size', 'last_access']
+    _COLUMN_SPECS = ['text primary key', 'text not null', 'text', 'text', 'real', 'integer', 'real']
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self._directory = directory
+        self._objects_dir = os.path.join(directory, 'objects')
+        self._max_bytes = max_bytes
+        self._db = SQLite3(os.path.join(directory, 'index.db'))
+        self._db.create_table_if_not_exists(self._TABLE, self._COLUMNS, self._COLUMN_SPECS)
+        self._db.execute('create index if not exists entries_last_access on entries (last_access)')
+        self._db.commit()
+        self._total = self._db.execute('select coalesce(sum(size), 0) from entries').fetchone()[0]
+        self._stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stored': 0, 'evicted': 0}
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def lookup(self, url: str) -> Optional[_CacheEntry]:
+        row = self._db.execute(
+            'select digest, status_line, headers, expires_at, size from entries where url = ?', (url, )
+        ).fetchone()
+        if row is None or not os.path.exists(self._object_path(row[0])):
+            return None
+        return _CacheEntry(url, row[0], row[1], json.loads(row[2]), row[3], row[4])
+
+    def _result_of(self, entry: _CacheEntry) -> HTTPResult:
+        # committed with the next store / close; losing a few recency updates on a crash is harmless
+        self._db.execute('update entries set last_access = ? where url = ?', (time.time(), entry.url))
+        with open(self._object_path(entry.digest), 'rb') as f:
+            body = io.BytesIO(f.read())
+        heads = (entry.status_line, ) + tuple('%s: %s' % kv for kv in entry.headers.items())
+        return HTTPResult(200, body, heads)
+
+    def hit(self, entry: _CacheEntry) -> HTTPResult:
+        self._stats['hits'] += 1
+        return self._result_of(entry)
+
+    def miss(self):
+        self._stats['misses'] += 1
+
+    def revalidated(self, entry: _CacheEntry, not_modified: HTTPResult) -> HTTPResult:
+        """Merge the headers of a 304 into ``entry`` (RFC 7234 4.3.4) and serve its body from disk."""
+        self._stats['revalidated'] += 1
+        entry.headers.update((k, v) for k, v in not_modified.get_headers().items() if k not in _TRANSFER_HEADERS)
+        entry.expires_at = _expires_at(entry.headers) or 0
+        self._db.execute(
+            'update entries set headers = ?, expires_at = ? where url = ?',
+            (json.dumps(entry.headers), entry.expires_at, entry.url)
+        )
+        return self._result_of(entry)
+
+    def store(self, url: str, result: HTTPResult):
+        if result.get_status_code() != 200:
+            return
+        headers = {k: v for k, v in result.get_headers().items() if k not in _TRANSFER_HEADERS}
+        expires_at = _expires_at(headers)
+        if expires_at is None:  # no-store
+            return
+        if expires_at <= time.time() and 'etag' not in headers and 'last-modified' not in headers:
+            return  # could neither be served nor revalidated
+        view = result.get_body_view()
+        digest = hashlib.sha256(view).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(view)
+            os.replace(tmp, path)
+        view.release()
+        status_line = [h for h in result.get_head() if h.startswith('HTTP/')][-1]
+        old = self._db.execute('select size from entries where url = ?', (url, )).fetchone()
+        self._db.execute(
+            'insert or replace into entries (%s) values (?, ?, ?, ?, ?, ?, ?)' % ', '.join(self._COLUMNS),
+            (url, digest, status_line, json.dumps(headers), expires_at, result.get_body_size(), time.time())
+        )
+        self._total += result.get_body_size() - (old[0] if old else 0)
+        self._stats['stored'] += 1
+        self._evict()
+        self._db.commit()
+
+    def _evict(self):
+        while self._total > self._max_bytes:
+            rows = self._db.execute(
+                'select url, digest, size from entries order by last_access limit 64'
+            ).fetchall()
+            if not rows:
+                break
+            for url, digest, size in rows:
+                self._db.execute('delete from entries where url = ?', (url, ))
+                self._total -= size
+                self._stats['evicted'] += 1
+                if self._db.execute('select 1 from entries where digest = ? limit 1', (digest, )).fetchone() is None:
+                    try:
+                        os.remove(self._object_path(digest))
+                    except OSError:
+                        Log.w('could not remove cached object %s', digest)
+                if self._total <= self._max_bytes:
+                    break
+
+    def get_stats(self) -> dict:
+        """hits / misses / revalidated (304s served from disk) / stored / evicted counts, plus the stored bytes."""
+        return dict(self._stats, bytes=self._total)
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+def _parse_date(value: str) -> Optional[float]:
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _expires_at(headers: dict) -> Optional[float]:
+    """Absolute expiry time for a response, 0 if it must be revalidated before use, None if it must not be stored."""
+    directives = {}
+    for item in headers.get('cache-control', '').split(','):
+        name, _, value = item.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+    now = time.time()
+    for name in ('s-maxage', 'max-age'):
+        if directives.get(name, '').isdigit():
+            age = headers.get('age', '0')
+            return now + int(directives[name]) - (int(age) if age.isdigit() else 0)
+    if 'expires' in headers:
+        expires = _parse_date(headers['expires'])
+        if expires is None:
+            return 0
+        date = _parse_date(headers.get('date', ''))
+        # relative to the server's clock, as RFC 7234 asks
+        return now + (expires - date) if date is not None else expires
+    return 0
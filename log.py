@@ -1,14 +1,32 @@
-import inspect
 import traceback
 import sys
+import atexit
 import datetime
+import io
+import json
+import math
 import os
+import random
+import threading
+import time
+import types
+from contextlib import contextmanager
+from contextvars import ContextVar
+from abc import abstractmethod, ABC
+from collections import deque
 from enum import IntEnum
+from functools import lru_cache, partial, wraps
+from typing import Callable, Iterable, List, Optional, Tuple
 
 import colorama
 
 colorama.init()
 
+# contents of these types are evaluated lazily, only when the record is actually printed
+_DEFERRED_TYPES = (types.FunctionType, partial)
+# per-thread / per-task fields (worker id, url, job id, ...) attached to every record
+_context = ContextVar('Log.context', default=None)
+
 
 class ConsoleColors:
     RED = '\033[91m'
@@ -32,115 +50,940 @@ class Log:
         WARN = WARNING
         ERROR = 4
 
+    class Overflow(IntEnum):
+        BLOCK = 0  # wait for the writer thread to make room
+        DROP_OLDEST = 1  # discard the oldest queued record
+        DROP = 2  # discard the new record and count it
+
     TAG = 'Log'
-    _level = Level.ALL
+    # kept as a plain int so that filtered calls cost a single int comparison
+    _level = int(Level.ALL)
     _show_full_cls = False
+    _sink = None
+    _handlers = ()  # type: Tuple[LogHandler, ...]
+    _config_lock = threading.Lock()
+    _limiter = None
+    _metrics = None
 
     @classmethod
-    def _line_end(cls, kwargs: dict = ()):
-        if 'end' in kwargs.keys():
-            sys.stderr.write(kwargs['end'])
-        else:
-            sys.stderr.write('\n')
+    def _print(cls, level: int, level_symbol='', contents=(), kwargs: dict = ()):
+        # frames: _print <- Log.d/i/v/w/e <- caller
+        caller_frame = sys._getframe(2)
+        suppressed = 0
+        if cls._limiter is not None:
+            # decided before anything is formatted, so suppressed calls stay cheap
+            suppressed = cls._limiter.check(caller_frame, level, level_symbol)
+            if suppressed is None:
+                return
+        trbk = ''
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        if exc_tb is not None:
+            trbk = ''.join(traceback.format_tb(exc_tb)).strip()
+            if trbk:
+                trbk = '\n' + trbk + '\n' + '{0}: {1}'.format(exc_type.__name__, exc_value)
+        class_name = cls._class_name_of(caller_frame, cls._show_full_cls)
+        if not cls._show_full_cls and level_symbol:
+            level_symbol = '/' + level_symbol
+        record = LogRecord(
+            level, level_symbol, datetime.datetime.now(), cls.TAG, class_name, _file_label(caller_frame.f_code),
+            caller_frame.f_lineno, cls._format_contents(contents), trbk, kwargs['end'] if 'end' in kwargs else '\n',
+            _context.get()
+        )
+        if suppressed:
+            cls._dispatch(LogRecord(
+                level, level_symbol, record.created, record.tag, class_name, record.file_name, record.line_no,
+                'suppressed %d similar messages' % suppressed, '', '\n', record.context
+            ))
+        cls._dispatch(record)
 
     @classmethod
-    def _print(cls, level_symbol='', contents=()):
-        trbk = ''.join(traceback.format_tb(sys.exc_info()[2])).strip()
-        if trbk:
-            trbk = '\n' + trbk + '\n' + '{0}: {1}'.format(sys.exc_info()[0].__name__, sys.exc_info()[1])
-        if len(contents) > 1:
-            contents = '%s ' % (contents,)
-        elif len(contents) == 1:
-            contents = '%s ' % (contents[0], )
-        else:
-            contents = ''
-        if cls._show_full_cls:
-            class_name = cls.get_full_class_name()
-        else:
-            class_name = cls.get_simple_class_name()
-            if level_symbol:
-                level_symbol = '/' + level_symbol
-        sys.stderr.write('{0} {1} {2}/{6} {3}{4}{5}'.format(
-            cls.get_datetime_str(), class_name, cls.TAG, contents, cls.get_file_info(), trbk, level_symbol
+    def _summary_template(cls, frame, level: int, level_symbol: str) -> tuple:
+        """Where a rate-limited call site's "suppressed K similar messages" record comes from."""
+        if not cls._show_full_cls and level_symbol:
+            level_symbol = '/' + level_symbol
+        return (level, level_symbol, cls.TAG, cls._class_name_of(frame, cls._show_full_cls),
+                _file_label(frame.f_code), frame.f_lineno, _context.get())
+
+    @classmethod
+    def _dispatch_summary(cls, template: tuple, suppressed: int):
+        level, level_symbol, tag, class_name, file_name, line_no, context = template
+        cls._dispatch(LogRecord(
+            level, level_symbol, datetime.datetime.now(), tag, class_name, file_name, line_no,
+            'suppressed %d similar messages' % suppressed, '', '\n', context
         ))
 
+    @classmethod
+    def _dispatch(cls, record: 'LogRecord'):
+        if cls._sink is not None:
+            cls._sink.put(record)
+        else:
+            for handler in cls._handlers:
+                handler.handle(record)
+
+    @staticmethod
+    def _format_contents(contents: tuple) -> Optional[str]:
+        """
+        Build the message part of a record. Functions/partials among the contents are called here,
+        i.e. only once the level check has passed, and ``Log.d('fetched %s in %.2fs', url, dt)``
+        is formatted printf-style. Anything that does not fit the format string is printed as a
+        tuple, as before. Returns None when there is nothing to print.
+        """
+        if not contents:
+            return None
+        contents = tuple(c() if isinstance(c, _DEFERRED_TYPES) else c for c in contents)
+        if len(contents) == 1:
+            return '%s' % (contents[0], )
+        if isinstance(contents[0], str) and '%' in contents[0]:
+            try:
+                return contents[0] % contents[1:]
+            except (TypeError, ValueError, KeyError):
+                pass
+        return '%s' % (contents, )
+
     @classmethod
     def set_level(cls, level):
-        cls._level = level
+        cls._level = int(level)
+
+    @classmethod
+    def is_enabled(cls, level) -> bool:
+        """
+        Cheap check for hot loops that want to skip building log arguments entirely:
+
+            if Log.is_enabled(Log.Level.DEBUG):
+                Log.d(expensive_dump())
+        """
+        return cls._level <= level
 
     @classmethod
     def set_show_full_class_name(cls, b: bool = False):
         cls._show_full_cls = b
 
+    @classmethod
+    def set_rate_limit(cls, limit: Optional[int] = None, period: float = 1.0, sample_rate: float = 1.0,
+                       sample_max_level=Level.INFO):
+        """
+        Throttle repetitive messages per call site (file, line):
+
+        - ``limit``: at most this many records per ``period`` seconds from one call site; ``None`` for no limit.
+        - ``sample_rate``: probability of keeping a record of level ``sample_max_level`` or below.
+
+        Once a site's period is over, a "suppressed K similar messages" summary is logged: before its next record,
+        or by a background timer if the site has gone quiet. ``flush`` and interpreter exit report pending counts.
+        Calling with the defaults turns throttling off.
+        """
+        old = cls._limiter
+        if limit is None and sample_rate >= 1.0:
+            cls._limiter = None
+        else:
+            cls._limiter = _RateLimiter(limit, period, sample_rate, int(sample_max_level))
+        if old is not None:
+            old.stop()
+
+    @classmethod
+    def add_handler(cls, handler: 'LogHandler'):
+        # the tuple is replaced, never mutated, so emitting threads can iterate it without locking
+        with cls._config_lock:
+            if handler not in cls._handlers:
+                cls._handlers = cls._handlers + (handler, )
+
+    @classmethod
+    def remove_handler(cls, handler: 'LogHandler'):
+        with cls._config_lock:
+            cls._handlers = tuple(h for h in cls._handlers if h is not handler)
+
+    @classmethod
+    def set_handlers(cls, handlers: Iterable['LogHandler']):
+        with cls._config_lock:
+            cls._handlers = tuple(handlers)
+
+    @classmethod
+    def get_handlers(cls) -> Tuple['LogHandler', ...]:
+        return cls._handlers
+
+    @classmethod
+    @contextmanager
+    def context(cls, **fields):
+        """
+        Attach ``fields`` to every record logged inside the block, in this thread / asyncio task only:
+
+            with Log.context(worker=3, url=url):
+                Log.i('fetched')
+        """
+        current = _context.get()
+        token = _context.set(dict(current, **fields) if current else fields)
+        try:
+            yield
+        finally:
+            _context.reset(token)
+
+    @classmethod
+    def set_context(cls, **fields):
+        """Like ``context`` but without a block, e.g. once in a worker initializer. ``None`` values unset a field."""
+        merged = dict(_context.get() or {}, **fields)
+        _context.set({k: v for k, v in merged.items() if v is not None} or None)
+
+    @classmethod
+    def get_context(cls) -> dict:
+        return dict(_context.get() or {})
+
+    @classmethod
+    def init_worker(cls, queue, level=None, tag: str = None, **fields):
+        """
+        ``multiprocessing`` initializer: send this process' records to ``queue``, where a ``LogQueueListener``
+        in the parent writes them out, so records from many processes never interleave.
+
+            queue = multiprocessing.Queue()
+            listener = LogQueueListener(queue).start()
+            pool = multiprocessing.Pool(8, Log.init_worker, (queue, Log.Level.INFO))
+            ...
+            pool.close()
+            pool.join()  # let the workers flush their queue before stopping the listener
+            listener.stop()
+        """
+        if cls._sink is not None:
+            cls.set_async(False)
+        if level is not None:
+            cls.set_level(level)
+        if tag is not None:
+            cls.TAG = tag
+        cls.set_handlers((QueueHandler(queue), ))
+        if fields:
+            cls.set_context(**fields)
+
+    @classmethod
+    def set_async(cls, enabled: bool = True, queue_size: int = 10000, overflow=Overflow.BLOCK,
+                  batch_size: int = 256):
+        """
+        Switch between passing records to the handlers directly (default) and handing them to a bounded queue
+        that a background thread drains into the handlers in batches. ``overflow`` decides what a full queue does
+        with a new record.
+        Disabling drains whatever is still queued.
+        """
+        if cls._sink is not None:
+            cls._sink.close()
+            cls._sink = None
+        if enabled:
+            cls._sink = _AsyncSink(queue_size, Log.Overflow(overflow), batch_size)
+
+    @classmethod
+    def flush(cls):
+        """Block until every record logged so far has been written out."""
+        limiter = cls._limiter
+        if limiter is not None:
+            limiter.report(everything=True)
+        if cls._sink is not None:
+            cls._sink.flush()
+        for handler in cls._handlers:
+            handler.flush()
+
+    @classmethod
+    def get_dropped_count(cls) -> int:
+        """Number of records discarded by the DROP / DROP_OLDEST overflow policies."""
+        return cls._sink.dropped if cls._sink is not None else 0
+
+    @classmethod
+    def set_metrics(cls, enabled: bool = True, report_interval: float = 0):
+        """
+        Turn the in-process timers / counters on or off. With ``report_interval`` (seconds) a summary is logged
+        periodically; ``report_metrics`` prints one on demand. While disabled, ``timer``/``count``/``observe``
+        record nothing and cost a single attribute check.
+        """
+        if cls._metrics is not None:
+            cls._metrics.stop()
+            cls._metrics = None
+        if enabled:
+            cls._metrics = _MetricRegistry(report_interval)
+
+    @classmethod
+    def timer(cls, name: str) -> '_Timer':
+        """
+        Time a block or every call of a function into the histogram ``name``:
+
+            with Log.timer('fetch'):
+                ...
+
+            @Log.timer('parse')
+            def parse(...):
+        """
+        return _Timer(name)
+
+    @classmethod
+    def count(cls, name: str, n: int = 1):
+        if cls._metrics is not None:
+            cls._metrics.count(name, n)
+
+    @classmethod
+    def observe(cls, name: str, value: float):
+        if cls._metrics is not None:
+            cls._metrics.observe(name, value)
+
+    @classmethod
+    def get_metrics(cls) -> dict:
+        """Snapshot: {name: count} for counters and {name: {count, total, min, max, p50, p95, p99}} for histograms."""
+        return cls._metrics.snapshot() if cls._metrics is not None else {}
+
+    @classmethod
+    def report_metrics(cls, reset: bool = False):
+        """Log one INFO line per counter / histogram."""
+        for name, value in sorted(cls.get_metrics().items()):
+            if isinstance(value, dict):
+                cls.i('metric %s: count=%d total=%.6g min=%.6g max=%.6g p50=%.6g p95=%.6g p99=%.6g',
+                      name, value['count'], value['total'], value['min'], value['max'],
+                      value['p50'], value['p95'], value['p99'])
+            else:
+                cls.i('metric %s: count=%d', name, value)
+        if reset and cls._metrics is not None:
+            cls._metrics.reset()
+
     @classmethod
     def w(cls, *contents, **kwargs):
-        if cls._level >= 0 and cls._level > Log.Level.WARN:
+        if cls._level > _WARN:
             return
-        sys.stderr.write(ConsoleColors.YELLOW)
-        cls._print('W', contents)
-        sys.stderr.write(ConsoleColors.END_CODE)
-        cls._line_end(kwargs)
+        cls._print(_WARN, 'W', contents, kwargs)
 
     @classmethod
     def e(cls, *contents, **kwargs):
-        if cls._level >= 0 and cls._level > Log.Level.ERROR:
+        if cls._level > _ERROR:
             return
-        sys.stderr.write(ConsoleColors.RED)
-        cls._print('E', contents)
-        sys.stderr.write(ConsoleColors.END_CODE)
-        cls._line_end(kwargs)
+        cls._print(_ERROR, 'E', contents, kwargs)
 
     @classmethod
     def i(cls, *contents, **kwargs):
-        if cls._level >= 0 and cls._level > Log.Level.INFO:
+        if cls._level > _INFO:
             return
-        cls._print('D', contents)
-        cls._line_end(kwargs)
+        cls._print(_INFO, 'D', contents, kwargs)
 
     @classmethod
     def v(cls, *contents, **kwargs):
-        if cls._level >= 0 and cls._level > Log.Level.VERBOSE:
+        if cls._level > _VERBOSE:
             return
-        cls._print('D', contents)
-        cls._line_end(kwargs)
+        cls._print(_VERBOSE, 'D', contents, kwargs)
 
     @classmethod
     def d(cls, *contents, **kwargs):
-        if cls._level >= 0 and cls._level > Log.Level.DEBUG:
+        if cls._level > _DEBUG:
             return
-        cls._print('D', contents)
-        cls._line_end(kwargs)
+        cls._print(_DEBUG, 'D', contents, kwargs)
 
     @classmethod
     def get_file_info(cls):
-        caller_frame = inspect.stack()[3][0]
-        return '({0}:{1:d})'.format(os.path.basename(caller_frame.f_code.co_filename), caller_frame.f_lineno)
+        return cls._file_info_of(sys._getframe(3))
 
     @classmethod
     def get_full_class_name(cls):
-        caller_frame = inspect.stack()[3][0]
-        class_name = '__main__.'
-        if 'self' in caller_frame.f_locals:
-            class_name = '%s.%s#' % (
-                caller_frame.f_locals['self'].__class__.__module__, caller_frame.f_locals['self'].__class__.__name__
-            )
-        elif 'cls' in caller_frame.f_locals:
-            class_name = '%s.%s.' % (
-                caller_frame.f_locals['cls'].__module__, caller_frame.f_locals['cls'].__name__
-            )
-        return '{0}{1}'.format(class_name, caller_frame.f_code.co_name)
+        return cls._class_name_of(sys._getframe(3), True)
 
     @classmethod
     def get_simple_class_name(cls):
-        caller_frame = inspect.stack()[3][0]
-        class_name = '__main__.'
-        if 'self' in caller_frame.f_locals:
-            class_name = '%s#' % caller_frame.f_locals['self'].__class__.__name__
-        elif 'cls' in caller_frame.f_locals:
-            class_name = '%s.' % caller_frame.f_locals['cls'].__name__
-        return '{0}{1}'.format(class_name, caller_frame.f_code.co_name)
+        return cls._class_name_of(sys._getframe(3), False)
+
+    @staticmethod
+    def _file_info_of(frame) -> str:
+        return '({0}:{1:d})'.format(_file_label(frame.f_code), frame.f_lineno)
+
+    @staticmethod
+    def _class_name_of(frame, full: bool) -> str:
+        code = frame.f_code
+        owner, is_instance = None, False
+        # only materialize f_locals when the function can actually hold self/cls
+        if _may_hold_owner(code):
+            _locals = frame.f_locals
+            if 'self' in _locals:
+                owner, is_instance = _locals['self'].__class__, True
+            elif 'cls' in _locals:
+                owner = _locals['cls']
+        try:
+            return _class_label(code, owner, is_instance, full)
+        except TypeError:  # unhashable cls local; format without caching
+            return _class_label.__wrapped__(code, owner, is_instance, full)
 
     @classmethod
-    def get_datetime_str(cls):
-        now_time = datetime.datetime.now()
+    def get_datetime_str(cls, now_time: datetime.datetime = None):
+        if now_time is None:
+            now_time = datetime.datetime.now()
         return '{0}.{1:03.0f}'.format(now_time.strftime('%m-%d %H:%M:%S'), int(now_time.strftime('%f')) / 1000)
+
+
+class _AsyncSink:
+    """Bounded record queue drained into the Log handlers by one background writer thread."""
+
+    def __init__(self, queue_size: int, overflow, batch_size: int):
+        self._queue = deque()
+        self._queue_size = max(1, queue_size)
+        self._overflow = overflow
+        self._batch_size = max(1, batch_size)
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._done_cond = threading.Condition(self._lock)
+        self._queued = 0  # records ever accepted into the queue
+        self._done = 0  # records written out or evicted by DROP_OLDEST
+        self._closed = False
+        self._failed = set()  # ids of handlers whose errors were already reported
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='Log-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, record: 'LogRecord'):
+        with self._lock:
+            if len(self._queue) >= self._queue_size and not self._closed and self._thread.is_alive():
+                if self._overflow == Log.Overflow.DROP:
+                    self.dropped += 1
+                    return
+                elif self._overflow == Log.Overflow.DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                    self._done += 1
+                else:
+                    while len(self._queue) >= self._queue_size and not self._closed and self._thread.is_alive():
+                        self._not_full.wait()
+            # nobody would drain the queue any more: write synchronously
+            if self._closed or not self._thread.is_alive():
+                for handler in Log._handlers:
+                    handler.handle(record)
+                return
+            self._queue.append(record)
+            self._queued += 1
+            self._not_empty.notify()
+
+    def _run(self):
+        queue = self._queue
+        try:
+            while True:
+                with self._lock:
+                    while not queue and not self._closed:
+                        self._not_empty.wait()
+                    if not queue:
+                        return
+                    n = min(len(queue), self._batch_size)
+                    batch = [queue.popleft() for _ in range(n)]
+                    self._not_full.notify_all()
+                for handler in Log._handlers:
+                    try:
+                        handler.handle_batch(batch)
+                        handler.flush()
+                    except Exception as e:  # a broken handler / filter must not stop the others or the thread
+                        self._report(handler, e)
+                with self._lock:
+                    self._done += n
+                    self._done_cond.notify_all()
+        finally:
+            # wake callers blocked in put / flush so they notice the thread is gone
+            with self._lock:
+                self._not_full.notify_all()
+                self._done_cond.notify_all()
+
+    def _report(self, handler: 'LogHandler', error: Exception):
+        if id(handler) in self._failed:
+            return
+        self._failed.add(id(handler))
+        stream = sys.__stderr__
+        if stream is not None:
+            try:
+                stream.write('Log: handler %r raised %s: %s (reported once, the handler is kept)\n'
+                             % (handler, type(error).__name__, error))
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def flush(self):
+        with self._lock:
+            target = self._queued
+            while self._done < target and self._thread.is_alive():
+                self._done_cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        self._thread.join()
+
+
+class _RateLimiter:
+    """
+    Fixed-window counter per call site plus optional random sampling of low-level records. A timer thread reports
+    the suppressed counts of sites that went quiet once their window is over.
+    """
+
+    def __init__(self, limit: Optional[int], period: float, sample_rate: float, sample_max_level: int):
+        self._limit = limit
+        self._period = period
+        self._sample_rate = sample_rate
+        self._sample_max_level = sample_max_level
+        # (code, line) -> [window start, records passed, records suppressed, Log._summary_template or None]
+        self._sites = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='Log-rate-limiter', daemon=True)
+        self._thread.start()
+
+    def check(self, frame, level: int, level_symbol: str) -> Optional[int]:
+        """None if the record must be dropped, else the number of suppressed records to report first."""
+        now = time.monotonic()
+        key = (frame.f_code, frame.f_lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [now, 0, 0, None]
+            suppressed = 0
+            if now - site[0] >= self._period:
+                suppressed = site[2]
+                site[0], site[1], site[2] = now, 0, 0
+            if (level <= self._sample_max_level and self._sample_rate < 1.0 and random.random() >= self._sample_rate) \
+                    or (self._limit is not None and site[1] >= self._limit):
+                site[2] += suppressed + 1
+                if site[3] is None:
+                    site[3] = Log._summary_template(frame, level, level_symbol)
+                return None
+            site[1] += 1
+            return suppressed
+
+    def report(self, everything: bool = False):
+        """Log the summaries of sites whose window is over (of every site with ``everything``)."""
+        now = time.monotonic()
+        pending = []
+        with self._lock:
+            for key, site in list(self._sites.items()):
+                expired = now - site[0] >= self._period
+                if site[2] and (everything or expired):
+                    pending.append((site[3], site[2]))
+                    site[2] = 0
+                    if expired:
+                        site[0], site[1] = now, 0
+                elif expired:
+                    del self._sites[key]  # quiet sites are forgotten, so the table doesn't grow without bound
+        for template, suppressed in pending:
+            Log._dispatch_summary(template, suppressed)
+
+    def _run(self):
+        while not self._stopped.wait(self._period):
+            self.report()
+
+    def stop(self):
+        """Stop the timer and report every pending count."""
+        self._stopped.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self.report(everything=True)
+
+
+class _Histogram:
+    """
+    Log-bucketed sketch (values within ~1% relative error), so memory is bounded by the bucket range
+    rather than by the number of observations.
+    """
+    __slots__ = ('count', 'total', 'min', 'max', '_buckets')
+    _GAMMA = 1.02
+    _LOG_GAMMA = math.log(_GAMMA)
+    _MIN_KEY = int(math.log(1e-9) / _LOG_GAMMA)  # everything below 1ns (or <= 0) shares one bucket
+    _MAX_KEY = int(math.log(1e9) / _LOG_GAMMA)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buckets = {}
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        key = self._MIN_KEY
+        if value > 0:
+            key = min(max(int(math.ceil(math.log(value) / self._LOG_GAMMA)), self._MIN_KEY), self._MAX_KEY)
+        self._buckets[key] = self._buckets.get(key, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if seen > rank:
+                # bucket covers (gamma^(k-1), gamma^k]; report its midpoint, clamped to what was observed
+                value = 2 * self._GAMMA ** key / (self._GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+            'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+        }
+
+
+class _MetricRegistry:
+    def __init__(self, report_interval: float):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._stopped = threading.Event()
+        self._thread = None
+        if report_interval:
+            self._thread = threading.Thread(target=self._run, args=(report_interval, ), name='Log-metrics',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self, interval: float):
+        while not self._stopped.wait(interval):
+            Log.report_metrics()
+
+    def stop(self):
+        self._stopped.set()
+
+    def count(self, name: str, n: int):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = _Histogram()
+            hist.add(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ret = dict(self._counters)
+            ret.update((name, hist.to_dict()) for name, hist in self._histograms.items())
+        return ret
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class _Timer:
+    """Returned by ``Log.timer``; usable as a context manager or as a decorator."""
+    __slots__ = ('_name', '_start')
+
+    def __init__(self, name: str):
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        if Log._metrics is not None:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        metrics = Log._metrics
+        if self._start is not None and metrics is not None:
+            metrics.observe(self._name, time.perf_counter() - self._start)
+        self._start = None
+
+    def __call__(self, func: Callable) -> Callable:
+        name = self._name
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if Log._metrics is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics = Log._metrics
+                if metrics is not None:
+                    metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+
+
+class LogRecord:
+    __slots__ = ('level', 'level_symbol', 'created', 'tag', 'class_name', 'file_name', 'line_no', 'message',
+                 'exc_text', 'end', 'context')
+
+    def __init__(self, level: int, level_symbol: str, created: datetime.datetime, tag: str, class_name: str,
+                 file_name: str, line_no: int, message: Optional[str], exc_text: str, end: str,
+                 context: Optional[dict] = None):
+        self.level = level
+        self.level_symbol = level_symbol
+        self.created = created
+        self.tag = tag
+        self.class_name = class_name
+        self.file_name = file_name
+        self.line_no = line_no
+        self.message = message
+        self.exc_text = exc_text
+        self.end = end
+        self.context = context
+
+    def to_dict(self) -> dict:
+        return {
+            'time': self.created.isoformat(),
+            'level': Log.Level(self.level).name,
+            'tag': self.tag,
+            'class': self.class_name,
+            'file': self.file_name,
+            'line': self.line_no,
+            'message': self.message,
+            'exc': self.exc_text.strip() or None,
+            'context': self.context,
+        }
+
+
+class LogHandler(ABC):
+    """Receives every record that passes ``Log``'s level and its own ``level``."""
+
+    def __init__(self, level=Log.Level.ALL, filter: Callable[[LogRecord], bool] = None):
+        self.level = int(level)
+        self.filter = filter
+        self._lock = threading.RLock()
+
+    def handle(self, record: LogRecord):
+        if record.level >= self.level and (self.filter is None or self.filter(record)):
+            with self._lock:
+                self.emit(record)
+
+    def handle_batch(self, records: List[LogRecord]):
+        with self._lock:
+            for record in records:
+                self.handle(record)
+
+    @abstractmethod
+    def emit(self, record: LogRecord):
+        raise NotImplementedError()
+
+    def format(self, record: LogRecord) -> str:
+        return '{0} {1} {2}/{6} {3}{4}{5}'.format(
+            Log.get_datetime_str(record.created), record.class_name, record.tag,
+            ('' if record.message is None else record.message + ' ') +
+            ('' if not record.context else '[%s] ' % ' '.join('%s=%s' % kv for kv in record.context.items())),
+            '({0}:{1:d})'.format(record.file_name, record.line_no), record.exc_text, record.level_symbol
+        ) + record.end
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class StreamHandler(LogHandler):
+    """Colored console output; writes to sys.stderr (looked up on every write) unless a stream is given."""
+    _COLORS = {int(Log.Level.WARN): ConsoleColors.YELLOW, int(Log.Level.ERROR): ConsoleColors.RED}
+
+    def __init__(self, stream: io.TextIOBase = None, level=Log.Level.ALL, filter=None, colored: bool = True):
+        super().__init__(level, filter)
+        self._stream = stream
+        self._colored = colored
+        self._buffer = io.StringIO()
+
+    def _get_stream(self) -> io.TextIOBase:
+        return self._stream if self._stream is not None else sys.stderr
+
+    def format(self, record: LogRecord) -> str:
+        line = super().format(record)
+        color = self._COLORS.get(record.level) if self._colored else None
+        if color:
+            return color + line[:len(line) - len(record.end)] + ConsoleColors.END_CODE + record.end
+        return line
+
+    def emit(self, record: LogRecord):
+        self._get_stream().write(self.format(record))
+
+    def handle_batch(self, records: List[LogRecord]):
+        # one write per batch, formatted into a reused buffer
+        with self._lock:
+            buf = self._buffer
+            buf.seek(0)
+            buf.truncate()
+            for record in records:
+                if record.level >= self.level and (self.filter is None or self.filter(record)):
+                    buf.write(self.format(record))
+            if buf.tell():
+                self._get_stream().write(buf.getvalue())
+
+    def flush(self):
+        self._get_stream().flush()
+
+
+class RotatingFileHandler(LogHandler):
+    """
+    Plain text records appended to one buffered file descriptor. The file is rotated to ``path.1``, ``path.2``, ...
+    once it grows beyond ``max_bytes`` and/or every ``interval`` seconds (0 disables either trigger).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, interval: float = 0, backup_count: int = 5,
+                 level=Log.Level.ALL, filter=None, encoding: str = 'utf_8', buffer_size: int = 65536):
+        super().__init__(level, filter)
+        self._path = os.path.abspath(path)
+        self._max_bytes = max_bytes
+        self._interval = interval
+        self._backup_count = backup_count
+        self._encoding = encoding
+        self._buffer_size = buffer_size
+        self._fp = None
+        self._size = 0
+        self._rollover_at = 0
+
+    def _open(self):
+        d = os.path.dirname(self._path)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        self._fp = open(self._path, 'ab', buffering=self._buffer_size)
+        self._size = self._fp.tell()
+        if self._interval:
+            self._rollover_at = time.time() + self._interval
+
+    def _should_rollover(self, n: int) -> bool:
+        if self._max_bytes and self._size and self._size + n > self._max_bytes:
+            return True
+        return bool(self._interval) and time.time() >= self._rollover_at
+
+    def _rollover(self):
+        self._fp.close()
+        self._fp = None
+        if self._backup_count > 0:
+            for i in range(self._backup_count - 1, 0, -1):
+                src = '%s.%d' % (self._path, i)
+                if os.path.exists(src):
+                    os.replace(src, '%s.%d' % (self._path, i + 1))
+            os.replace(self._path, self._path + '.1')
+        else:
+            os.remove(self._path)
+        self._open()
+
+    def emit(self, record: LogRecord):
+        data = self.format(record).encode(self._encoding, 'replace')
+        with self._lock:
+            if self._fp is None:
+                self._open()
+            elif self._should_rollover(len(data)):
+                self._rollover()
+            self._fp.write(data)
+            self._size += len(data)
+
+    def flush(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+
+class JSONLinesHandler(RotatingFileHandler):
+    """One JSON object per record, see ``LogRecord.to_dict``. Rotation works as in ``RotatingFileHandler``."""
+
+    def format(self, record: LogRecord) -> str:
+        return json.dumps(record.to_dict(), ensure_ascii=False, default=str) + '\n'
+
+
+class MemoryHandler(LogHandler):
+    """Keeps the last ``capacity`` records in memory, e.g. to dump them after a failure."""
+
+    def __init__(self, capacity: int = 1000, level=Log.Level.ALL, filter=None):
+        super().__init__(level, filter)
+        self._records = deque(maxlen=capacity)
+
+    def emit(self, record: LogRecord):
+        self._records.append(record)
+
+    def get_records(self) -> List[LogRecord]:
+        return list(self._records)
+
+    def dump(self, stream: io.TextIOBase = None):
+        stream = stream if stream is not None else sys.stderr
+        stream.write(''.join(self.format(r) for r in self.get_records()))
+
+    def clear(self):
+        self._records.clear()
+
+
+class QueueHandler(LogHandler):
+    """Puts records on a (multiprocessing) queue for a ``LogQueueListener``; see ``Log.init_worker``."""
+
+    def __init__(self, queue, level=Log.Level.ALL, filter=None):
+        super().__init__(level, filter)
+        self._queue = queue
+
+    def emit(self, record: LogRecord):
+        self._queue.put(record)
+
+
+class LogQueueListener:
+    """Background thread that passes records received from ``QueueHandler``s to local handlers."""
+    _SENTINEL = None
+
+    def __init__(self, queue, handlers: Iterable[LogHandler] = None):
+        self._queue = queue
+        self._handlers = tuple(handlers) if handlers is not None else None
+        self._thread = None
+
+    def start(self) -> 'LogQueueListener':
+        self._thread = threading.Thread(target=self._run, name='Log-queue-listener', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is self._SENTINEL:
+                break
+            for handler in self._handlers if self._handlers is not None else Log._handlers:
+                handler.handle(record)
+
+    def stop(self):
+        """Write out everything already queued, then stop the thread."""
+        if self._thread is not None:
+            self._queue.put(self._SENTINEL)
+            self._thread.join()
+            self._thread = None
+            for handler in self._handlers if self._handlers is not None else Log._handlers:
+                handler.flush()
+
+
+Log._handlers = (StreamHandler(), )
+
+
+@atexit.register
+def _drain_at_exit():
+    if Log._limiter is not None:
+        Log._limiter.stop()
+    if Log._metrics is not None:
+        Log._metrics.stop()
+    if Log._sink is not None:
+        Log.set_async(False)
+    for handler in Log._handlers:
+        handler.close()
+
+
+_DEBUG = int(Log.Level.DEBUG)
+_VERBOSE = int(Log.Level.VERBOSE)
+_INFO = int(Log.Level.INFO)
+_WARN = int(Log.Level.WARN)
+_ERROR = int(Log.Level.ERROR)
+
+
+@lru_cache(maxsize=1024)
+def _may_hold_owner(code) -> bool:
+    names = code.co_varnames + code.co_cellvars + code.co_freevars
+    return 'self' in names or 'cls' in names
+
+
+@lru_cache(maxsize=1024)
+def _file_label(code) -> str:
+    return os.path.basename(code.co_filename)
+
+
+@lru_cache(maxsize=1024)
+def _class_label(code, owner, is_instance: bool, full: bool) -> str:
+    class_name = '__main__.'
+    if owner is not None:
+        if full:
+            class_name = '%s.%s%s' % (owner.__module__, owner.__name__, '#' if is_instance else '.')
+        else:
+            class_name = '%s%s' % (owner.__name__, '#' if is_instance else '.')
+    return '{0}{1}'.format(class_name, code.co_name)
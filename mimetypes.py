@@ -1,27 +1,53 @@
+import codecs
 import os
 import io
+import stat
+import struct
 from abc import abstractmethod, ABC
-from typing import Union, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, Union, Tuple
 
 from .log import Log
 
 
 class _MimeGroupReflection(ABC):
+    def __new__(cls):
+        # stateless, so one instance per class is enough
+        instance = cls.__dict__.get('_instance')
+        if instance is None:
+            instance = cls._instance = super().__new__(cls)
+        return instance
+
     @abstractmethod
     def get_mime_str(self):
         raise NotImplementedError()
 
 
 class _MimeEntryReflection(ABC):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        global _index
+        _index = None  # a new type; rebuilt on the next lookup
+
+    def __new__(cls):
+        # entries are interned: MimeTypes.Text.HTML() is always the same object
+        instance = cls.__dict__.get('_instance')
+        if instance is None:
+            instance = cls._instance = super().__new__(cls)
+        return instance
+
     def __eq__(self, other):
-        _clazz = other
-        if isinstance(_clazz, self.__class__):
-            _clazz = other.__class__
-        return _clazz is self.__class__
+        # equal to itself and to its own class (not to subclasses)
+        return other is self or other is self.__class__
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.__class__)
+
     @abstractmethod
     def get_mime_str(self) -> str:
         raise NotImplementedError()
@@ -38,6 +64,28 @@ class _MimeEntryReflection(ABC):
     def is_str_decodable(self) -> bool:
         raise NotImplementedError()
 
+    def get_magic_rules(self) -> Tuple[Tuple, ...]:
+        """
+        Binary signatures beyond ``get_header_bytes``: ``(offset, pattern)`` or ``(offset, pattern, mask)``, where
+        only the bits set in ``mask`` are compared (e.g. RIFF????WEBP).
+        """
+        return ()
+
+    def refine(self, content: bytes) -> '_MimeEntryReflection':
+        """
+        Called after a binary signature matched: a more specific type found inside the container, this entry,
+        or None if ``content`` only looked like it.
+        """
+        return self
+
+    def get_text_score(self, window: bytes, lower: bytes) -> int:
+        """
+        How much a text sample looks like this type (0: not at all); the highest score wins. ``window`` is the
+        start of the text as UTF-8 with any BOM and leading whitespace removed, ``lower`` the same lower-cased.
+        """
+        headers = self.get_header_bytes()
+        return 10 if headers and window.startswith(headers) else 0
+
     def __str__(self):
         return self.get_mime_str()
 
@@ -46,8 +94,173 @@ class _MimeEntryReflection(ABC):
         return self.get_mime_str().startswith(_instance.get_mime_str())
 
 
+class _Index:
+    """Lookup tables over every known entry; built by _get_index, dropped when a type is added."""
+    __slots__ = ('entries', 'magic', 'rules', 'text', 'by_ext', 'by_mime', 'max_ext_dots')
+
+    def __init__(self, entries: list):
+        self.entries = tuple(entries)
+        self.magic = {}  # first byte -> ((header bytes, precedence, entry), ...) of binary types
+        self.rules = []  # (offset, length, mask as int, pattern as int, precedence, entry) of binary types
+        self.text = []  # text types, scored by get_text_score
+        self.by_ext = {}  # lower-case '.ext' / '.tar.gz' -> entry
+        self.by_mime = {}  # lower-case mime string -> entry
+        self.max_ext_dots = 1
+        for order, _instance in enumerate(self.entries):
+            if _instance.is_str_decodable():
+                self.text.append(_instance)
+            else:
+                headers = _instance.get_header_bytes()
+                for header in (headers, ) if isinstance(headers, bytes) else headers:
+                    if header:
+                        self.magic[header[0]] = self.magic.get(header[0], ()) + ((header, order, _instance), )
+                for rule in _instance.get_magic_rules():
+                    offset, pattern = rule[0], rule[1]
+                    mask = int.from_bytes(rule[2] if len(rule) > 2 else b'\xff' * len(pattern), 'big')
+                    self.rules.append(
+                        (offset, len(pattern), mask, int.from_bytes(pattern, 'big') & mask, order, _instance)
+                    )
+            exts = _instance.get_ext()
+            for ext in (exts, ) if isinstance(exts, str) else exts:
+                self.by_ext.setdefault(ext.lower(), _instance)
+                self.max_ext_dots = max(self.max_ext_dots, ext.count('.'))
+            self.by_mime.setdefault(_instance.get_mime_str().lower(), _instance)
+
+
+_index = None
+_registered = []  # MimeTypes.register, ahead of the subclasses found on their own
+
+
+def _get_index() -> _Index:
+    global _index
+    index = _index
+    if index is None:
+        entries = list(_registered)
+        entries += [_clazz for _clazz in _MimeEntryReflection.__subclasses__() if _clazz not in entries]
+        index = _index = _Index([_clazz() for _clazz in entries])
+    return index
+
+
+def _match_binary(index: _Index, content: bytes) -> _MimeEntryReflection:
+    """The first binary type (in precedence order) whose signature matches, or None."""
+    found, found_order = None, len(index.entries)
+    if content:
+        for header, order, _instance in index.magic.get(content[0], ()):
+            if content.startswith(header):
+                found, found_order = _instance, order
+                break
+    for offset, length, mask, pattern, order, _instance in index.rules:
+        if order >= found_order:
+            break
+        value = content[offset:offset + length]
+        if len(value) == length and int.from_bytes(value, 'big') & mask == pattern:
+            return _instance
+    return found
+
+
+def _text_window(content: bytes, size: int) -> bytes:
+    """
+    The first ``size`` bytes of ``content`` as UTF-8 without BOM and leading whitespace, or None if that part is
+    not text. UTF-16 with a BOM is converted.
+    """
+    encoding, start = 'UTF-8', 0
+    if content.startswith(codecs.BOM_UTF8):
+        start = len(codecs.BOM_UTF8)
+    elif content.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding, start = 'UTF-16', 0  # the codec consumes the BOM
+    window = content[start:start + size]
+    try:
+        text = codecs.getincrementaldecoder(encoding)().decode(window, final=len(content) - start <= size)
+    except UnicodeDecodeError:
+        return None
+    if encoding != 'UTF-8':
+        window = text.encode('UTF-8')
+    elif '\x00' in text:
+        return None  # valid UTF-8, but NUL bytes mean a binary format
+    return window.lstrip()
+
+
+def _sniff(content: bytes, size: int) -> _MimeEntryReflection:
+    index = _get_index() if _index is None else _index
+    found = _match_binary(index, content)
+    if found is not None:
+        found = found.refine(content)
+        if found is not None:
+            return found
+    window = _text_window(content, size)
+    if window is None:
+        return MimeTypes.Application.OctetStream()
+    lower = window.lower()
+    best_score = 0
+    for _instance in index.text:
+        score = _instance.get_text_score(window, lower)
+        if score > best_score:
+            found, best_score = _instance, score
+    return found or MimeTypes.Text.Plain()
+
+
+_ZIP_LOCAL = struct.Struct('<4sHHHHHIIIHH')  # local file header, 30 bytes
+_ZIP_CENTRAL = struct.Struct('<4sHHHHHHIIIHHHHHII')  # central directory header, 46 bytes
+_ZIP_END = struct.Struct('<4sHHHHIIH')  # end of central directory record, 22 bytes
+
+
+def _zip_local_entries(content: bytes) -> Iterator[Tuple[str, bytes]]:
+    """(name, data if stored else b'') of the members at the start of a zip, as far as ``content`` goes."""
+    pos = 0
+    while pos + _ZIP_LOCAL.size <= len(content):
+        (sig, _, flags, method, _, _, _, comp_size, _, name_len, extra_len) = _ZIP_LOCAL.unpack_from(content, pos)
+        if sig != b'PK\x03\x04':
+            return
+        name = content[pos + 30:pos + 30 + name_len].decode('UTF-8', 'replace')
+        data_start = pos + 30 + name_len + extra_len
+        yield name, content[data_start:data_start + comp_size] if method == 0 else b''
+        if flags & 0x08 and not comp_size:
+            return  # size only in a data descriptor after the data; the next header can't be located
+        pos = data_start + comp_size
+
+
+def _zip_central_names(tail: bytes) -> Iterator[str]:
+    """Member names from the central directory, if it is within ``tail`` (the last bytes of the zip)."""
+    end = tail.rfind(b'PK\x05\x06')
+    if end < 0 or end + _ZIP_END.size > len(tail):
+        return
+    cd_size = _ZIP_END.unpack_from(tail, end)[5]
+    pos = end - cd_size
+    if pos < 0:
+        return
+    while pos + _ZIP_CENTRAL.size <= end:
+        fields = _ZIP_CENTRAL.unpack_from(tail, pos)
+        if fields[0] != b'PK\x01\x02':
+            return
+        name_len, extra_len, comment_len = fields[10], fields[11], fields[12]
+        yield tail[pos + 46:pos + 46 + name_len].decode('UTF-8', 'replace')
+        pos += 46 + name_len + extra_len + comment_len
+
+
+def _zip_kind(entries: Iterable[Tuple[str, bytes]]) -> _MimeEntryReflection:
+    """The zip based format (OOXML, EPUB / OpenDocument) given its members, or None if they don't tell."""
+    content_types = False
+    part = None
+    for name, data in entries:
+        if name == 'mimetype' and data:
+            # EPUB and OpenDocument store their type uncompressed as the first member
+            _instance = MimeTypes.from_str(data.decode('ascii', 'replace').strip())
+            if _instance != MimeTypes.Application.OctetStream:
+                return _instance
+        elif name == '[Content_Types].xml':
+            content_types = True
+        elif part is None:
+            for prefix, _clazz in _OOXML_PARTS:
+                if name.startswith(prefix):
+                    part = _clazz()
+        if content_types and part is not None:
+            return part
+    return None
+
+
 class MimeTypes:
     _LIMIT_MAX_FILESIZE = 20971520  # 20MB
+    _SNIFF_SIZE = 8192  # bytes checked for UTF-8 to tell text from binary
 
     class Application(_MimeGroupReflection):
         def get_mime_str(self) -> str:
@@ -92,6 +305,147 @@ class MimeTypes:
             def get_ext(self) -> Union[str, Tuple[str, ...]]:
                 return '.json'
 
+            def get_text_score(self, window: bytes, lower: bytes) -> int:
+                if not window.startswith((b'{', b'[')):
+                    return 0
+                rest = window[1:].lstrip()
+                if not rest:
+                    return 1
+                # what may follow: a key or '}' in an object, any value or ']' in an array
+                return 50 if rest[0] in (b'"}' if window[0] == 0x7B else b'"{[]-0123456789tfn') else 0
+
+        class ZIP(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return b'PK\x03\x04', b'PK\x05\x06'  # the latter: empty archive
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".zip"
+
+            def get_mime_str(self) -> str:
+                return "application/zip"
+
+            def refine(self, content: bytes) -> _MimeEntryReflection:
+                # the central directory is only in content if it is the whole file
+                return _zip_kind(_zip_local_entries(content)) or \
+                    _zip_kind((name, b'') for name in _zip_central_names(content)) or self
+
+        class DOCX(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()  # found inside a ZIP
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".docx"
+
+            def get_mime_str(self) -> str:
+                return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+        class XLSX(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".xlsx"
+
+            def get_mime_str(self) -> str:
+                return "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+        class PPTX(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".pptx"
+
+            def get_mime_str(self) -> str:
+                return "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+        class EPUB(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".epub"
+
+            def get_mime_str(self) -> str:
+                return "application/epub+zip"
+
+        class ODT(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".odt"
+
+            def get_mime_str(self) -> str:
+                return "application/vnd.oasis.opendocument.text"
+
+        class Gzip(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return b'\x1f\x8b'
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".gz"
+
+            def get_mime_str(self) -> str:
+                return "application/gzip"
+
+            def refine(self, content: bytes) -> _MimeEntryReflection:
+                # RFC 1952: deflate is the only method, the top three flag bits are reserved
+                if len(content) < 10 or content[2] != 8 or content[3] & 0xE0:
+                    return None
+                return self
+
+        class Tar(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()
+
+            def get_magic_rules(self) -> Tuple[Tuple, ...]:
+                return (257, b'ustar'),
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".tar"
+
+            def get_mime_str(self) -> str:
+                return "application/x-tar"
+
+        class TarGzip(_MimeEntryReflection):
+            # only known by name: by content it is application/gzip, the tar header is compressed
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".tar.gz", ".tgz"
+
+            def get_mime_str(self) -> str:
+                return "application/x-gtar"
+
     class Text(_MimeGroupReflection):
         def get_mime_str(self) -> str:
             return "text"
@@ -109,6 +463,17 @@ class MimeTypes:
             def get_mime_str(self) -> str:
                 return "text/html"
 
+            def get_text_score(self, window: bytes, lower: bytes) -> int:
+                if lower.startswith(b'<!doctype html'):
+                    return 100
+                head = lower[:1024]  # tags near the start are enough, counting is slow on markup-heavy text
+                if lower.startswith(b'<?xml'):  # XHTML
+                    return 100 if b'<!doctype html' in head or b'<html' in head else 0
+                if not lower.startswith(b'<'):
+                    return 0
+                score = 20 if lower.startswith((b'<html', b'<head', b'<body')) else 0
+                return score + sum(head.count(tag) for tag in _HTML_TAGS)
+
         class Plain(_MimeEntryReflection):
             def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
                 return ()
@@ -135,6 +500,12 @@ class MimeTypes:
             def get_mime_str(self) -> str:
                 return "text/xml"
 
+            def get_text_score(self, window: bytes, lower: bytes) -> int:
+                if window.startswith(b'<?xml'):
+                    return 50
+                # any other element start: XML unless something scores better
+                return 1 if window[:1] == b'<' and window[1:2].isalpha() else 0
+
     class Image(_MimeGroupReflection):
         def get_mime_str(self) -> str:
             return "image"
@@ -180,7 +551,7 @@ class MimeTypes:
 
         class TIFF(_MimeEntryReflection):
             def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
-                return b'\x49\x49', b'\x4D\x4D'
+                return b'II*\x00', b'MM\x00*'  # byte order mark, then the magic 42 in that order
 
             def is_str_decodable(self) -> bool:
                 return False
@@ -204,6 +575,31 @@ class MimeTypes:
             def get_mime_str(self) -> str:
                 return "image/bmp"
 
+            def refine(self, content: bytes) -> _MimeEntryReflection:
+                # 'BM' starts plenty of text: also require the zero reserved field, a file size that fits the
+                # headers and a known DIB header size
+                if len(content) < 18 or content[6:10] != b'\x00\x00\x00\x00':
+                    return None
+                file_size = int.from_bytes(content[2:6], 'little')
+                dib_size = int.from_bytes(content[14:18], 'little')
+                return self if file_size >= 26 and dib_size in (12, 40, 52, 56, 64, 108, 124) else None
+
+        class WEBP(_MimeEntryReflection):
+            def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
+                return ()
+
+            def get_magic_rules(self) -> Tuple[Tuple, ...]:
+                return (0, b'RIFF\0\0\0\0WEBP', b'\xff\xff\xff\xff\0\0\0\0\xff\xff\xff\xff'),
+
+            def is_str_decodable(self) -> bool:
+                return False
+
+            def get_ext(self) -> Union[str, Tuple[str, ...]]:
+                return ".webp"
+
+            def get_mime_str(self) -> str:
+                return "image/webp"
+
         class SVG(_MimeEntryReflection):
             def is_str_decodable(self) -> bool:
                 return True
@@ -217,66 +613,174 @@ class MimeTypes:
             def get_header_bytes(self) -> Union[bytes, Tuple[bytes, ...]]:
                 return b'<svg'
 
+            def get_text_score(self, window: bytes, lower: bytes) -> int:
+                if lower.startswith((b'<svg', b'<!doctype svg')):
+                    return 100
+                # an XML declaration (and maybe comments / doctype) before the root element
+                return 60 if window.startswith(b'<?xml') and b'<svg' in window else 0
+
     @classmethod
     def set_max_filesize(cls, byte: int):
+        """No longer limits anything: sniffing reads only the first ``_SNIFF_SIZE`` bytes of any file."""
         MimeTypes._LIMIT_MAX_FILESIZE = byte
 
+    @classmethod
+    def register(cls, entry: type) -> type:
+        """
+        Make the ``_MimeEntryReflection`` subclass ``entry`` known to every lookup, ahead of the types defined so
+        far where extensions, mime strings or magic bytes overlap. Usable as a class decorator. Direct
+        subclasses of ``_MimeEntryReflection`` are picked up without registering.
+        """
+        global _index
+        if entry in _registered:
+            _registered.remove(entry)
+        _registered.insert(0, entry)
+        _index = None
+        return entry
+
+    @classmethod
+    def get_entries(cls) -> tuple:
+        return _get_index().entries
+
     @classmethod
     def guess_by_file_name(cls, file_name: str) -> _MimeEntryReflection:
-        base, ext = os.path.splitext(file_name)
-        for _clazz in _MimeEntryReflection.__subclasses__():
-            _instance = _clazz()
-            if ext in _instance.get_ext():
-                return _instance
-        return MimeTypes.Application.OctetStream()
+        """By extension, case-insensitively; the longest known one wins ('a.tar.gz': '.tar.gz' before '.gz')."""
+        index = _get_index() if _index is None else _index
+        by_ext = index.by_ext
+        start = max(file_name.rfind('/'), file_name.rfind(os.sep)) + 1  # the base name
+        found = None
+        end = len(file_name)
+        for _ in range(index.max_ext_dots):
+            end = file_name.rfind('.', start, end)
+            if end <= start:  # no (further) extension, or a dot file like '.bashrc'
+                break
+            ext = file_name[end:]
+            _instance = by_ext.get(ext)
+            if _instance is None and not ext.islower():
+                _instance = by_ext.get(ext.lower())
+            if _instance is not None:
+                found = _instance
+        return found or MimeTypes.Application.OctetStream()
 
     @classmethod
     def from_str(cls, mime_type_str: str) -> _MimeEntryReflection:
-        for _clazz in _MimeEntryReflection.__subclasses__():
-            _instance = _clazz()
-            if mime_type_str == _instance.get_mime_str():
-                return _instance
-        return MimeTypes.Application.OctetStream()
+        """Case-insensitive; parameters such as '; charset=utf-8' are ignored."""
+        by_mime = (_get_index() if _index is None else _index).by_mime
+        _instance = by_mime.get(mime_type_str)
+        if _instance is None:
+            _instance = by_mime.get(mime_type_str.split(';', 1)[0].strip().lower())
+        return _instance or MimeTypes.Application.OctetStream()
 
     @classmethod
     def guess_by_file(cls, file_path: str):
-        if os.path.isfile(file_path):
-            try:
-                fsize = os.path.getsize(file_path)
-                if fsize > MimeTypes._LIMIT_MAX_FILESIZE:
-                    Log.w(
-                        '%s: %d bytes > limit %d bytes; not reading' %
-                        (file_path, fsize, MimeTypes._LIMIT_MAX_FILESIZE)
-                    )
-                else:
-                    with open(file_path, "rb") as f:
-                        if f.readable():
-                            return MimeTypes.guess_by_bytes(f.read())
-            except OSError:
-                Log.e(file_path + " - open error")
-        else:
+        """
+        Sniffs the start of a regular file; a missing file or a directory is guessed by name. FIFOs, devices and
+        sockets give None without being opened (reading a FIFO would block).
+        """
+        missing = False
+        try:
+            mode = os.stat(file_path).st_mode
+            if stat.S_ISDIR(mode):
+                missing = True
+            elif not stat.S_ISREG(mode):
+                Log.w(file_path + " - not a regular file")
+                return None
+            else:
+                # one byte past the window tells guess_by_bytes whether the file goes on
+                with open(file_path, "rb", buffering=0) as f:
+                    head = f.read(MimeTypes._SNIFF_SIZE + 1)
+                    _instance = MimeTypes.guess_by_bytes(head)
+                    if _instance is MimeTypes.Application.ZIP():
+                        # members not in the first bytes are listed by the central directory at the end
+                        size = os.fstat(f.fileno()).st_size
+                        f.seek(max(0, size - _ZIP_TAIL_SIZE))
+                        _instance = _zip_kind((name, b'') for name in _zip_central_names(f.read())) or _instance
+                return _instance
+        except (FileNotFoundError, IsADirectoryError):
+            missing = True
+        except OSError:
+            pass
+        if missing:
             Log.w(file_path + " - No such file")
+        else:
+            Log.e(file_path + " - open error")
         return MimeTypes.guess_by_file_name(os.path.basename(file_path))
 
     @classmethod
     def guess_by_buffer(cls, content: io.BufferedIOBase) -> _MimeEntryReflection:
-        return MimeTypes.guess_by_bytes(content.read())
+        """
+        Sniffs the first bytes of ``content`` and leaves its position unchanged if it is seekable (or can
+        ``peek``); other streams lose the bytes read.
+        """
+        size = MimeTypes._SNIFF_SIZE + 1
+        if content.seekable():
+            pos = content.tell()
+            head = content.read(size)
+            content.seek(pos)
+        elif hasattr(content, 'peek'):
+            head = content.peek(size)[:size]  # may be shorter than asked for: whatever is buffered
+        else:
+            head = content.read(size)
+        return MimeTypes.guess_by_bytes(head)
+
+    @classmethod
+    def guess_many(cls, paths: Iterable[str], max_workers: int = 8) -> Iterator[Tuple[str, _MimeEntryReflection]]:
+        """
+        ``(path, guess_by_file(path))`` for every file in ``paths``, in order; directories are walked recursively
+        (without following symlinked directories). Files are sniffed in batches by ``max_workers`` threads, with
+        only a few batches queued ahead, so ``paths`` can be an arbitrarily long generator.
+        """
+        files = _iter_files(paths)
+        with ThreadPoolExecutor(max_workers) as executor:
+            pending = deque()
+            while True:
+                batch = list(islice(files, _GUESS_BATCH))
+                if batch:
+                    pending.append(executor.submit(_guess_batch, batch))
+                if pending and (not batch or len(pending) >= 2 * max_workers):
+                    yield from pending.popleft().result()
+                elif not batch:
+                    break
 
     @classmethod
     def guess_by_bytes(cls, content: bytes) -> _MimeEntryReflection:
-        decode_ok = False
-        try:
-            content.decode('UTF-8')
-            decode_ok = True
-        except UnicodeDecodeError:
-            pass
-        for _clazz in _MimeEntryReflection.__subclasses__():
-            _instance = _clazz()
-            if content.startswith(_instance.get_header_bytes()):
-                if _instance.is_str_decodable() and not decode_ok:
-                    continue
-                return _instance
-        if decode_ok:
-            return MimeTypes.Text.Plain()
-        else:
-            return MimeTypes.Application.OctetStream()
+        """
+        Binary signatures first (``get_header_bytes`` / ``get_magic_rules``, then ``refine``: members of a ZIP,
+        gzip header sanity). Otherwise, if the first ``_SNIFF_SIZE`` bytes are text (UTF-8, or UTF-16 with a
+        BOM), the text type with the best ``get_text_score``, else text/plain; octet-stream for anything else.
+        """
+        return _sniff(content, MimeTypes._SNIFF_SIZE)
+
+
+# bytes read from the end of a zip file for its central directory
+_ZIP_TAIL_SIZE = 1 << 20
+_HTML_TAGS = (
+    b'<html', b'<head', b'<body', b'<div', b'<p>', b'<a ', b'<script', b'<meta', b'<title', b'<br', b'<table'
+)
+_OOXML_PARTS = (
+    ('word/', MimeTypes.Application.DOCX), ('xl/', MimeTypes.Application.XLSX), ('ppt/', MimeTypes.Application.PPTX)
+)
+# files per thread pool task; one file alone costs less than handing it to a thread
+_GUESS_BATCH = 64
+
+
+def _guess_batch(paths: list) -> list:
+    return [(path, MimeTypes.guess_by_file(path)) for path in paths]
+
+
+def _iter_files(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        stack = [path]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
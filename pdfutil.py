@@ -1,62 +1,128 @@
+import asyncio
+import collections
+import functools
+import hashlib
 import io
+import itertools
+import math
+import mmap
+import os
 import pycurl
 import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
 import certifi
 from pdfminer.converter import PDFPageAggregator
 from pdfminer.layout import LAParams, LTTextBox
+from pdfminer.pdfdevice import PDFDevice
+from pdfminer.pdffont import PDFUnicodeNotDefined
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.pdfparser import PDFParser, PDFDocument
 from pdfminer.pdftypes import PDFException
+from pdfminer.utils import apply_matrix_pt, mult_matrix
 
+from .curldownloader import AsyncCurlDownloader
 from .log import Log
 
 
 # PDFから情報を取ってくるユーティリティ
 class PDFUtil:
+    _cache = None
+
     @classmethod
-    def parse_text_from_buffer(cls, buffer: io.BytesIO, password='') -> str:
-        ret = ""
-        try:
-            parser = PDFParser(buffer)
-            document = PDFDocument()
-            parser.set_document(document)  # set document to parser
+    def set_cache(cls, cache: 'PDFTextCache'):
+        """Serve ``parse_text_from_*`` from ``cache`` (or stop caching with None)."""
+        cls._cache = cache
+
+    @classmethod
+    def _open_document(cls, buffer: io.BytesIO, password='') -> PDFDocument:
+        parser = PDFParser(buffer)
+        document = PDFDocument()
+        parser.set_document(document)  # set document to parser
 
-            # Create a PDF document object that stores the document structure.
-            # Supply the password for initialization.
-            document.set_parser(parser)  # set parser to document
-            document.initialize(password)
+        # Create a PDF document object that stores the document structure.
+        # Supply the password for initialization.
+        document.set_parser(parser)  # set parser to document
+        document.initialize(password)
+        return document
 
+    @classmethod
+    def iter_pages_from_buffer(cls, buffer: io.BytesIO, password='', start=0, stop=None, fast=False) -> Iterator[str]:
+        """
+        Yield the text of each page in [start, stop) as soon as it is extracted. ``fast`` skips layout analysis and
+        returns the text in content-stream order, one line per baseline. Pages are timed into the
+        ``PDFUtil.page`` / ``PDFUtil.page_fast`` histograms.
+        """
+        try:
+            document = cls._open_document(buffer, password)
             # Check if the document allows text extraction. If not, abort.
             if not document.is_extractable:
                 Log.e('pdf file is not extractable')
-                return ''
-
-            manager = PDFResourceManager()
-            page_a = PDFPageAggregator(manager, laparams=LAParams())
-            interpreter = PDFPageInterpreter(manager, page_a)
-
-            # Process each page contained in the document.
-            for page in document.get_pages():
-                interpreter.process_page(page)
-                layout = page_a.get_result()
-                for obj in layout:
-                    if isinstance(obj, LTTextBox):
-                        ret += obj.get_text()
-                        print(obj.get_text())
-
+                return
+            extractor = _PageExtractor(fast)
+            for page in itertools.islice(document.get_pages(), start, stop):
+                yield extractor.extract(page)
         except PDFException:
             pass
 
-        return PDFUtil.wrap_content_tag(ret)
+    @classmethod
+    def count_pages(cls, buffer: io.BytesIO, password='') -> int:
+        try:
+            return sum(1 for _ in cls._open_document(buffer, password).get_pages())
+        except PDFException:
+            return 0
 
     @classmethod
-    def parse_text_from_bytes(cls, _bytes: bytes, password='') -> str:
+    @Log.timer('PDFUtil.parse_text_from_buffer')
+    def parse_text_from_buffer(cls, buffer: io.BytesIO, password='', processes=1, pages_per_task=16,
+                               fast=False) -> str:
+        """
+        ``processes`` > 1 splits the document into ranges of ``pages_per_task`` pages and extracts them in a process
+        pool; pdfminer is pure Python, so threads would not help. See ``iter_pages_from_buffer`` for ``fast``.
+        """
+        key = None
+        if cls._cache is not None:
+            key = _digest(buffer) + ('.fast' if fast else '')
+            text = cls._cache.get(key)
+            if text is not None:
+                return PDFUtil.wrap_content_tag(text)
+        if processes > 1:
+            data = buffer.getvalue() if isinstance(buffer, io.BytesIO) else buffer.read()
+            pages = cls._parse_pages_parallel(data, password, processes, pages_per_task, fast)
+        else:
+            pages = list(cls.iter_pages_from_buffer(buffer, password, fast=fast))
+        text = ''.join(pages)
+        # an empty result may just be a wrong password, so it is not remembered
+        if key is not None and text:
+            cls._cache.put(key, text)
+        return PDFUtil.wrap_content_tag(text)
+
+    @classmethod
+    def _parse_pages_parallel(cls, data: bytes, password: str, processes: int, pages_per_task: int,
+                              fast: bool) -> List[str]:
+        n_pages = cls.count_pages(io.BytesIO(data), password)
+        if n_pages <= pages_per_task:
+            return list(cls.iter_pages_from_buffer(io.BytesIO(data), password, fast=fast))
+        ranges = range(0, n_pages, pages_per_task)
+        ret = []
+        # the document is sent once per worker, not once per range
+        with ProcessPoolExecutor(min(processes, len(ranges)), initializer=_init_worker,
+                                 initargs=(data, password, fast)) as executor:
+            for texts, complete in executor.map(_extract_range, ranges, itertools.repeat(pages_per_task)):
+                ret.extend(texts)
+                if not complete:  # stop where the serial path would have
+                    break
+        return ret
+
+    @classmethod
+    def parse_text_from_bytes(cls, _bytes: bytes, password='', fast=False) -> str:
         buffer = io.BytesIO(_bytes)
-        return cls.parse_text_from_buffer(buffer, password)
+        return cls.parse_text_from_buffer(buffer, password, fast=fast)
 
     @classmethod
-    def parse_text_from_file(cls, destination: str, password='') -> str:
+    def parse_text_from_file(cls, destination: str, password='', fast=False) -> str:
         if destination.startswith('http'):
             curl = pycurl.Curl()
             fp = tempfile.TemporaryFile()
@@ -64,12 +130,235 @@ class PDFUtil:
             curl.setopt(pycurl.CAINFO, certifi.where())
             curl.setopt(pycurl.WRITEFUNCTION, fp.write)
             curl.perform()
+            curl.close()
             fp.seek(0)
         else:
-            fp = open(destination, 'rb')
+            # the parser seeks around the xref table and objects; let the page cache serve that
+            with open(destination, 'rb') as f:
+                try:
+                    fp = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:  # empty file
+                    fp = io.BytesIO()
+
+        try:
+            return PDFUtil.parse_text_from_buffer(fp, password, fast=fast)
+        finally:
+            fp.close()
 
-        return PDFUtil.parse_text_from_buffer(fp, password)
+    @classmethod
+    async def parse_text_from_url_async(cls, url: str, password='', downloader: AsyncCurlDownloader = None,
+                                        fast=False) -> str:
+        # the download runs on the event loop, the CPU-bound parsing in the default executor
+        own_downloader = downloader is None
+        if own_downloader:
+            downloader = AsyncCurlDownloader()
+        try:
+            result = await downloader.get(url)
+        finally:
+            if own_downloader:
+                downloader.close()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(cls.parse_text_from_buffer, result.get_body(), password, fast=fast)
+        )
 
     @classmethod
     def wrap_content_tag(cls, instr: str) -> str:
         return "<html><head></head><body><main>%s</main></body></html>" % instr
+
+
+class PDFTextCache:
+    """
+    On-disk cache for ``PDFUtil`` (``PDFUtil.set_cache``): the extracted text of a document, keyed by the SHA-256 of
+    its bytes and the extraction mode, one UTF-8 file per entry under ``directory``. Least recently used entries are
+    removed once the stored text exceeds ``max_bytes``.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 << 20):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # path -> size, least recently used first; recency survives restarts through the file mtimes
+        found = []
+        for sub in os.scandir(directory):
+            if sub.is_dir():
+                found.extend((e.stat().st_mtime, e.path, e.stat().st_size)
+                             for e in os.scandir(sub.path) if e.name.endswith('.txt'))
+        self._entries = collections.OrderedDict((path, size) for _, path, size in sorted(found))
+        self._total = sum(self._entries.values())
+        self._stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key[:2], key + '.txt')
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path)
+        except OSError:
+            text = None
+        with self._lock:
+            if text is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return text
+
+    def put(self, key: str, text: str):
+        path = self._path(key)
+        data = text.encode('utf-8')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(data) - self._entries.pop(path, 0)
+            self._entries[path] = len(data)
+            self._stats['stored'] += 1
+            while self._total > self._max_bytes and len(self._entries) > 1:
+                old, size = self._entries.popitem(last=False)
+                self._total -= size
+                self._stats['evicted'] += 1
+                try:
+                    os.remove(old)
+                except OSError:
+                    Log.w('could not remove cached text %s', old)
+
+    def get_stats(self) -> dict:
+        """hits / misses / stored / evicted counts, plus the stored bytes."""
+        with self._lock:
+            return dict(self._stats, bytes=self._total)
+
+
+def _digest(buffer) -> str:
+    """SHA-256 of a whole buffer; the read position is left unchanged."""
+    if isinstance(buffer, io.BytesIO):
+        with buffer.getbuffer() as view:
+            return hashlib.sha256(view).hexdigest()
+    if isinstance(buffer, mmap.mmap):
+        return hashlib.sha256(buffer).hexdigest()
+    position = buffer.tell()
+    buffer.seek(0)
+    h = hashlib.sha256()
+    for chunk in iter(lambda: buffer.read(1 << 20), b''):
+        h.update(chunk)
+    buffer.seek(position)
+    return h.hexdigest()
+
+
+class _TextOnlyDevice(PDFDevice):
+    """
+    Collects the shown strings without building layout objects: no per-character LTChar, no line / box grouping.
+    The pen position is still tracked, so a line break is written when the baseline moves and a space when the pen
+    jumps along it (a TJ offset or a Td) by more than ``_WORD_GAP`` of the font size.
+    """
+    _WORD_GAP = 0.2
+
+    def __init__(self, manager: PDFResourceManager):
+        super().__init__(manager)
+        self._parts = []
+        self._end = None  # device position after the previous string, and that string's direction / size
+
+    def begin_page(self, page, ctm):
+        self._parts = []
+        self._end = None
+
+    def _separate(self, separator: str):
+        if self._parts and self._parts[-1] not in (' ', '\n'):
+            self._parts.append(separator)
+
+    def render_string(self, textstate, seq):
+        matrix = mult_matrix(textstate.matrix, self.ctm)
+        font = textstate.font
+        fontsize = textstate.fontsize
+        scaling = textstate.scaling * .01
+        charspace = textstate.charspace * scaling
+        wordspace = 0 if font.is_multibyte() else textstate.wordspace * scaling
+        dxscale = .001 * fontsize * scaling
+        (x, y) = textstate.linematrix
+        (sx, sy) = apply_matrix_pt(matrix, (x, y))
+        if self._end is not None:
+            (ex, ey, ux, uy, size) = self._end
+            along = (sx - ex) * ux + (sy - ey) * uy
+            across = (sy - ey) * ux - (sx - ex) * uy
+            if abs(across) > size / 2:
+                self._separate('\n')
+            elif along > self._WORD_GAP * size or along < -size:
+                self._separate(' ')
+        needcharspace = False
+        for obj in seq:
+            if isinstance(obj, (int, float)):
+                x -= obj * dxscale
+                if -obj * .001 > self._WORD_GAP:  # in thousandths of the font size, negative moves forward
+                    self._separate(' ')
+                needcharspace = True
+                continue
+            for cid in font.decode(obj):
+                if needcharspace:
+                    x += charspace
+                try:
+                    self._parts.append(font.to_unichr(cid))
+                except PDFUnicodeNotDefined:
+                    pass
+                x += font.char_width(cid) * fontsize * scaling
+                if cid == 32 and wordspace:
+                    x += wordspace
+                needcharspace = True
+        textstate.linematrix = (x, y)
+        (ex, ey) = apply_matrix_pt(matrix, (x, y))
+        unit = math.hypot(matrix[0], matrix[1]) or 1.0
+        self._end = (ex, ey, matrix[0] / unit, matrix[1] / unit, fontsize * (math.hypot(matrix[2], matrix[3]) or 1.0))
+
+    def get_result(self) -> str:
+        if self._parts and self._parts[-1] != '\n':
+            self._parts.append('\n')
+        return ''.join(self._parts)
+
+
+class _PageExtractor:
+    """One resource manager / device / interpreter, reused across pages."""
+    __slots__ = ('_device', '_interpreter', '_fast', '_timer')
+
+    def __init__(self, fast=False):
+        manager = PDFResourceManager()
+        self._fast = fast
+        self._device = _TextOnlyDevice(manager) if fast else PDFPageAggregator(manager, laparams=LAParams())
+        self._interpreter = PDFPageInterpreter(manager, self._device)
+        self._timer = Log.timer('PDFUtil.page_fast' if fast else 'PDFUtil.page')
+
+    def extract(self, page) -> str:
+        with self._timer:
+            self._interpreter.process_page(page)
+            if self._fast:
+                return self._device.get_result()
+            return ''.join([obj.get_text() for obj in self._device.get_result() if isinstance(obj, LTTextBox)])
+
+
+# per-process state of a PDFUtil.parse_text_from_buffer pool worker
+_worker_pages = None
+_worker_extractor = None
+
+
+def _init_worker(data: bytes, password: str, fast: bool):
+    global _worker_pages, _worker_extractor
+    try:
+        document = PDFUtil._open_document(io.BytesIO(data), password)
+        _worker_pages = list(document.get_pages()) if document.is_extractable else []
+    except PDFException:
+        _worker_pages = []
+    _worker_extractor = _PageExtractor(fast)
+
+
+def _extract_range(start: int, count: int) -> Tuple[List[str], bool]:
+    texts = []
+    for page in _worker_pages[start:start + count]:
+        try:
+            texts.append(_worker_extractor.extract(page))
+        except PDFException:
+            return texts, False
+    return texts, True
@@ -1,38 +1,251 @@
+import asyncio
 import sqlite3
 import os
+import queue
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, islice
 from sqlite3 import Cursor
-from typing import Tuple, Iterable
+from typing import Callable, Tuple, Iterable, Iterator, Union
 
 from .log import Log
 
 
 class SQLite3:
-    def __init__(self, db_name):
+    # for databases shared by concurrent readers and a writer; journal_mode is stored in the database file
+    PERFORMANCE_PRAGMAS = (
+        ('journal_mode', 'wal'),  # readers see the last commit instead of waiting for the writer
+        ('synchronous', 'normal'),  # with WAL a crash can lose the last commits, but never corrupts
+        ('mmap_size', 256 << 20),
+        ('cache_size', -(64 << 10)),  # negative: KiB
+        ('temp_store', 'memory'),
+    )
+
+    def __init__(self, db_name, performance: bool = False, check_same_thread: bool = True):
+        """
+        ``performance`` applies ``PERFORMANCE_PRAGMAS``; ``check_same_thread=False`` allows handing the
+        connection to other threads (one at a time, see ``SQLite3Pool``).
+        """
         if not os.path.isdir(os.path.dirname(db_name)):
             os.makedirs(os.path.dirname(db_name))
-        self._sql_conn = sqlite3.connect(db_name)
+        self._sql_conn = sqlite3.connect(db_name, check_same_thread=check_same_thread)
+        self._schema = None  # see _get_schema
+        if performance:
+            self.set_pragmas(self.PERFORMANCE_PRAGMAS)
+
+    def set_pragmas(self, pragmas: Iterable[Tuple[str, object]]):
+        for name, value in pragmas:
+            self.execute('pragma %s = %s' % (name, value))
 
     def cursor(self) -> Cursor:
         return self._sql_conn.cursor()
 
+    @Log.timer('SQLite3.execute')
     def execute(self, sql: str, parameters: Tuple=()) -> Cursor:
+        if _DDL.match(sql):
+            self._schema = None
         c = self.cursor()
         return c.execute(sql, parameters)
 
+    @Log.timer('SQLite3.executemany')
     def executemany(self, sql: str, parameters: Iterable[Iterable]) -> Cursor:
+        if _DDL.match(sql):
+            self._schema = None
         c = self.cursor()
         return c.executemany(sql, parameters)
 
-    def is_exists_table(self, table_name: str) -> bool:
-        sql = 'select name from sqlite_master where type=\'table\' and name=\'{0}\''.format(
-            table_name
+    def query(self, sql: str, parameters: Tuple = (), chunk_size: int = 1000, named: bool = False) -> Iterator:
+        """
+        Yield the result rows, fetching ``chunk_size`` at a time, so memory stays flat however many rows match.
+        ``named`` yields namedtuples with the result's column names (one class per column list, reused).
+        Close the generator (or exhaust it) to release the cursor.
+        """
+        if _DDL.match(sql):
+            self._schema = None
+        c = self.cursor()
+        try:
+            c.execute(sql, parameters)
+            make = _row_type(tuple(d[0] for d in c.description)) if named and c.description else None
+            while True:
+                rows = c.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if make is None:
+                    yield from rows
+                else:
+                    yield from map(make._make, rows)
+        finally:
+            c.close()
+
+    def select(self, table_name: str, columns: list = None, where: str = None, parameters: Tuple = (),
+               chunk_size: int = 1000, named: bool = True) -> Iterator:
+        """
+        ``query`` of only ``columns`` (all if None) of ``table_name``; ``where`` is an SQL condition with ``?``
+        placeholders bound to ``parameters``. Fetching just the needed columns keeps rows small and lets SQLite
+        answer from a covering index.
+        """
+        sql = 'select %s from %s' % (', '.join(map(_quote, columns)) if columns else '*', _quote(table_name))
+        if where:
+            sql += ' where ' + where
+        return self.query(sql, parameters, chunk_size, named)
+
+    @Log.timer('SQLite3.bulk_insert')
+    def bulk_insert(self, table_name: str, rows: Iterable[Union[Iterable, dict]], columns: list = None,
+                    batch_size: int = 1000, on_conflict: str = None, conflict_columns: list = None) -> dict:
+        """
+        Insert ``rows`` (any iterable, consumed lazily) in transactions of ``batch_size`` rows, each committed
+        before the next is read; one prepared statement is reused throughout. Rows are sequences in ``columns``
+        order, or dicts (``columns`` defaults to the keys of the first one).
+        ``on_conflict``: None (raise), 'ignore', 'replace', or 'update' (upsert on ``conflict_columns``, by default
+        the primary key, setting the other columns). Anything pending on the connection is committed with the
+        first batch; a failing batch is rolled back and the error re-raised, earlier batches stay committed.
+        Returns {'rows': rows read, 'written': rows inserted or updated, 'batches': transactions committed}.
+        """
+        rows = iter(rows)
+        first = next(rows, _MISSING)
+        counts = {'rows': 0, 'written': 0, 'batches': 0}
+        if first is _MISSING:
+            return counts
+        as_dict = isinstance(first, dict)
+        if columns is None:
+            if not as_dict:
+                raise ValueError('columns are required unless rows are dicts')
+            columns = list(first)
+        sql = self._insert_sql(table_name, columns, on_conflict, conflict_columns)
+        if as_dict:
+            # a missing key inserts NULL, like an omitted column would
+            rows = (tuple(row.get(column) for column in columns) for row in chain((first, ), rows))
+        else:
+            rows = chain((first, ), rows)
+        conn = self._sql_conn
+        c = self.cursor()
+        try:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                before = conn.total_changes
+                if not conn.in_transaction:
+                    c.execute('begin')
+                try:
+                    c.executemany(sql, batch)
+                    conn.commit()
+                except BaseException:
+                    self.rollback()
+                    raise
+                counts['rows'] += len(batch)
+                counts['written'] += conn.total_changes - before
+                counts['batches'] += 1
+        finally:
+            c.close()
+        return counts
+
+    def _insert_sql(self, table_name: str, columns: list, on_conflict: str, conflict_columns: list) -> str:
+        verb = {None: 'insert', 'ignore': 'insert or ignore', 'replace': 'insert or replace', 'update': 'insert'}
+        if on_conflict not in verb:
+            raise ValueError('on_conflict must be None, \'ignore\', \'replace\' or \'update\', not %r' % on_conflict)
+        sql = '%s into %s (%s) values (%s)' % (
+            verb[on_conflict], _quote(table_name), ', '.join(map(_quote, columns)), ', '.join('?' * len(columns))
         )
-        c = self.execute(sql)
-        return len(c.fetchall()) > 0
+        if on_conflict == 'update':
+            if conflict_columns is None:
+                info = self._get_table_info(table_name)
+                conflict_columns = [row[1] for row in sorted(info, key=lambda row: row[5]) if row[5]]
+                if not conflict_columns:
+                    raise ValueError('%s has no primary key; pass conflict_columns' % table_name)
+            updates = [column for column in columns if column not in conflict_columns]
+            sql += ' on conflict (%s) do %s' % (
+                ', '.join(map(_quote, conflict_columns)),
+                'update set ' + ', '.join('%s = excluded.%s' % (_quote(u), _quote(u)) for u in updates)
+                if updates else 'nothing'
+            )
+        return sql
+
+    def _get_schema(self) -> dict:
+        """
+        {'table' / 'index' / 'view' / 'trigger': {lower-case name: table name}}, read from sqlite_master once and
+        dropped whenever DDL goes through this wrapper (or ``invalidate_schema`` is called after DDL elsewhere).
+        """
+        if self._schema is None:
+            schema = {'table': {}, 'index': {}, 'view': {}, 'trigger': {}, 'table_info': {},
+                      'version': self._get_schema_version()}
+            for kind, name, table_name in self.cursor().execute('select type, name, tbl_name from sqlite_master'):
+                schema.setdefault(kind, {})[name.lower()] = table_name
+            self._schema = schema
+        return self._schema
+
+    def invalidate_schema(self):
+        self._schema = None
+
+    def _get_schema_version(self) -> int:
+        return self.cursor().execute('pragma schema_version').fetchone()[0]
+
+    def refresh_schema(self):
+        """Drop the schema cache if another connection has changed the schema since it was read."""
+        if self._schema is not None and self._schema['version'] != self._get_schema_version():
+            self._schema = None
+
+    def _get_table_info(self, table_name: str) -> list:
+        """Cached ``pragma table_info``: (cid, name, type, notnull, default, pk) per column."""
+        cache = self._get_schema()['table_info']
+        key = table_name.lower()
+        if key not in cache:
+            cache[key] = self.cursor().execute('pragma table_info(%s)' % _quote(table_name)).fetchall()
+        return cache[key]
+
+    def get_columns(self, table_name: str) -> list:
+        return [row[1] for row in self._get_table_info(table_name)]
+
+    def is_exists_table(self, table_name: str) -> bool:
+        return table_name.lower() in self._get_schema()['table']
+
+    def is_exists_index(self, index_name: str) -> bool:
+        return index_name.lower() in self._get_schema()['index']
+
+    def get_indexes(self, table_name: str) -> dict:
+        """{index name: indexed columns in order} for ``table_name``, including automatic ones (unique / pk)."""
+        indexes = {}
+        for name, owner in self._get_schema()['index'].items():
+            if owner.lower() == table_name.lower():
+                info = self.cursor().execute('pragma index_info(%s)' % _quote(name)).fetchall()
+                indexes[name] = [row[2] for row in sorted(info)]
+        return indexes
+
+    def create_index_if_not_exists(self, table_name: str, columns: list, index_name: str = None,
+                                   unique: bool = False, include: list = None, where: str = None) -> str:
+        """
+        Index ``table_name`` on ``columns``. SQLite has no INCLUDE clause, so ``include`` columns are appended to
+        the key: a lookup on ``columns`` that only reads ``columns + include`` is then answered from the index
+        alone (a covering index). ``where`` makes it a partial index. Returns the index name.
+        """
+        key = list(columns) + list(include or ())
+        if index_name is None:
+            index_name = 'idx_%s_%s' % (table_name, '_'.join(key))
+        if not self.is_exists_index(index_name):
+            sql = 'create %sindex if not exists %s on %s (%s)' % (
+                'unique ' if unique else '', _quote(index_name), _quote(table_name), ', '.join(map(_quote, key))
+            )
+            if where:
+                sql += ' where ' + where
+            self.execute(sql)
+            self.commit()
+        return index_name
+
+    def explain(self, sql: str, parameters: Tuple = ()) -> list:
+        """The ``EXPLAIN QUERY PLAN`` steps of ``sql``, e.g. 'SEARCH t USING INDEX idx_t_url (url=?)'."""
+        return [row[3] for row in self.cursor().execute('explain query plan ' + sql, parameters)]
+
+    def get_table_scans(self, sql: str, parameters: Tuple = ()) -> list:
+        """The plan steps of ``sql`` that read a whole table instead of searching an index; empty if none."""
+        return [step for step in self.explain(sql, parameters) if _TABLE_SCAN.match(step)]
 
     def force_create_table(self, table_name: str, columns: list, column_specs: list):
         if self.is_exists_table(table_name):
-            self.execute('drop table %s' % table_name)
+            self.execute('drop table %s' % _quote(table_name))
 
         self.create_table_if_not_exists(table_name, columns, column_specs)
 
@@ -45,15 +258,238 @@ class SQLite3:
 
         column_sql = ''
         for i in range(len(columns)):
-            column_sql += "%s %s" % (columns[i], column_specs[i])
+            column_sql += "%s %s" % (_quote(columns[i]), column_specs[i])
             if i + 1 < len(columns):
                 column_sql += ", "
-        sql = "create table %s (%s)" % (table_name, column_sql)
+        sql = "create table %s (%s)" % (_quote(table_name), column_sql)
         self.execute(sql)
         self.commit()
 
     def commit(self):
         self._sql_conn.commit()
 
+    def rollback(self):
+        self._sql_conn.rollback()
+        self._schema = None  # DDL is transactional in SQLite
+
     def close(self):
         self._sql_conn.close()
+
+
+_DDL = re.compile(r'\s*(create|drop|alter)\b', re.IGNORECASE)
+# 'SCAN t' / 'SCAN TABLE t' (older SQLite), but not 'SCAN t USING [COVERING] INDEX ...'
+_TABLE_SCAN = re.compile(r'SCAN (TABLE )?\S+( AS \S+)?$')
+
+_MISSING = object()  # next() default, as None may be a (bad) row
+
+
+@lru_cache(maxsize=256)
+def _row_type(columns: tuple) -> type:
+    return namedtuple('Row', columns, rename=True)
+
+
+def _quote(identifier: str) -> str:
+    return '"%s"' % identifier.replace('"', '""')
+
+
+class _Worker:
+    """
+    Thread owning one ``SQLite3`` and running queued jobs on it in order. Grouped jobs waiting together are
+    committed as one transaction, each in its own savepoint so a failing one doesn't undo the others; results are
+    only handed out after the commit.
+    """
+
+    def __init__(self, db: SQLite3, max_group: int, name: str):
+        self._db = db
+        self._max_group = max_group
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, func: Callable[[SQLite3], object], group: bool) -> Future:
+        future = Future()
+        self._jobs.put((func, group, future))
+        return future
+
+    def _run(self):
+        held = None
+        while True:
+            job = held if held is not None else self._jobs.get()
+            held = None
+            if job is None:
+                break
+            if not job[1]:
+                self._run_alone(job)
+                continue
+            jobs = [job]
+            while len(jobs) < self._max_group:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None or not job[1]:
+                    held = job
+                    break
+                jobs.append(job)
+            self._run_group(jobs)
+        self._db.close()
+
+    def _run_alone(self, job: tuple):
+        func, _, future = job
+        if not future.set_running_or_notify_cancel():
+            return
+        conn = self._db._sql_conn
+        try:
+            result = func(self._db)
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException as e:
+            if conn.in_transaction:
+                self._db.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _run_group(self, jobs: list):
+        db = self._db
+        conn = db._sql_conn
+        outcomes = []
+        try:
+            db.execute('begin')
+            for func, _, future in jobs:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                db.execute('savepoint job')
+                try:
+                    outcomes.append((future, True, func(db)))
+                except BaseException as e:
+                    db.execute('rollback to job')
+                    db.invalidate_schema()
+                    outcomes.append((future, False, e))
+                db.execute('release job')
+            conn.commit()
+        except BaseException as e:
+            if conn.in_transaction:
+                db.rollback()
+            for func, _, future in jobs:
+                if future.running():
+                    future.set_exception(e)
+            return
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self):
+        """Finish the queued jobs, then close the connection."""
+        self._jobs.put(None)
+        self._thread.join()
+
+
+class SQLite3Pool:
+    """
+    Thread-safe access to one database for many threads: ``readers`` read-only connections lent out by
+    ``reader()`` / ``query()``, and a single writer connection owned by a background thread. Writes are queued
+    and applied in order; small writes waiting together are committed as one transaction, each in its own
+    savepoint so a failing one doesn't undo the others. The database is opened with
+    ``SQLite3.PERFORMANCE_PRAGMAS`` (WAL), so reads never wait for the writer and writers never see
+    "database is locked".
+    """
+
+    def __init__(self, db_name: str, readers: int = 4, max_group: int = 256):
+        self._readers = queue.LifoQueue()
+        self._all_readers = []
+        for _ in range(max(1, readers)):
+            db = SQLite3(db_name, performance=True, check_same_thread=False)
+            db.execute('pragma query_only = on')
+            self._readers.put(db)
+            self._all_readers.append(db)
+        self._writer = _Worker(
+            SQLite3(db_name, performance=True, check_same_thread=False), max_group, 'SQLite3Pool writer'
+        )
+
+    @contextmanager
+    def reader(self) -> Iterator[SQLite3]:
+        """Borrow a read-only ``SQLite3``; blocks while all of them are in use."""
+        db = self._readers.get()
+        try:
+            db.refresh_schema()  # the writer may have run DDL since this reader cached the schema
+            yield db
+        finally:
+            if db._sql_conn.in_transaction:
+                db._sql_conn.rollback()  # don't pin an old snapshot of the WAL
+            self._readers.put(db)
+
+    def query(self, sql: str, parameters: Tuple = (), named: bool = False) -> list:
+        """All result rows; to stream a large result use ``SQLite3.query`` on a ``reader()``."""
+        with self.reader() as db:
+            return list(db.query(sql, parameters, named=named))
+
+    def submit(self, func: Callable[[SQLite3], object], group: bool = True) -> Future:
+        """
+        Run ``func(writer)`` on the writer thread; the future completes once it is committed. ``func`` must not
+        commit itself unless ``group`` is False, in which case it runs in a transaction of its own.
+        """
+        return self._writer.submit(func, group)
+
+    @Log.timer('SQLite3Pool.execute')
+    def execute(self, sql: str, parameters: Tuple = ()) -> int:
+        """Queue one write and wait for its commit; returns the affected row count."""
+        return self.submit(lambda db: db.execute(sql, parameters).rowcount).result()
+
+    @Log.timer('SQLite3Pool.executemany')
+    def executemany(self, sql: str, parameters: Iterable[Iterable]) -> int:
+        return self.submit(lambda db: db.executemany(sql, parameters).rowcount).result()
+
+    def bulk_insert(self, table_name: str, rows: Iterable, **kwargs) -> dict:
+        """``SQLite3.bulk_insert`` on the writer; it commits its own batches."""
+        return self.submit(lambda db: db.bulk_insert(table_name, rows, **kwargs), group=False).result()
+
+    def close(self):
+        """Finish the queued writes, then close every connection."""
+        self._writer.close()
+        for db in self._all_readers:
+            db.close()
+
+
+class AsyncSQLite3:
+    """
+    ``SQLite3`` for asyncio code: every operation runs on a worker thread that owns the connection, so the event
+    loop never blocks on disk. Writes awaited concurrently by many coroutines are committed together in one
+    transaction (each in its own savepoint, see ``SQLite3Pool``); once ``execute`` returns, the write is
+    committed, so there is nothing to ``commit`` explicitly. ``commit()`` only waits for earlier writes.
+    """
+
+    def __init__(self, db_name: str, performance: bool = True, max_group: int = 256):
+        self._worker = _Worker(
+            SQLite3(db_name, performance=performance, check_same_thread=False), max_group, 'AsyncSQLite3 worker'
+        )
+
+    def submit(self, func: Callable[[SQLite3], object], group: bool = True) -> asyncio.Future:
+        """As ``SQLite3Pool.submit``, awaitable."""
+        return asyncio.wrap_future(self._worker.submit(func, group))
+
+    async def execute(self, sql: str, parameters: Tuple = ()) -> int:
+        """Run one statement; returns the affected row count (use ``query`` to read rows)."""
+        with Log.timer('AsyncSQLite3.execute'):
+            return await self.submit(lambda db: db.execute(sql, parameters).rowcount)
+
+    async def executemany(self, sql: str, parameters: Iterable[Iterable]) -> int:
+        with Log.timer('AsyncSQLite3.executemany'):
+            return await self.submit(lambda db: db.executemany(sql, parameters).rowcount)
+
+    async def query(self, sql: str, parameters: Tuple = (), named: bool = False) -> list:
+        with Log.timer('AsyncSQLite3.query'):
+            return await self.submit(lambda db: list(db.query(sql, parameters, named=named)))
+
+    async def bulk_insert(self, table_name: str, rows: Iterable, **kwargs) -> dict:
+        """``SQLite3.bulk_insert`` on the worker; ``rows`` is consumed there, so it must not depend on the loop."""
+        return await self.submit(lambda db: db.bulk_insert(table_name, rows, **kwargs), group=False)
+
+    async def commit(self):
+        await self.submit(lambda db: None)
+
+    async def close(self):
+        """Finish the queued operations, then close the connection."""
+        await asyncio.get_running_loop().run_in_executor(None, self._worker.close)
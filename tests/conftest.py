@@ -0,0 +1,16 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# the repository root is the package itself, so it is imported by its directory name from the parent directory
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# run as `python -m pytest` from the root, modules like sqlite3.py / mimetypes.py would shadow the standard library
+sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != _ROOT]
+sys.path.insert(0, os.path.dirname(_ROOT))
+
+
+@pytest.fixture(scope='session')
+def package():
+    return importlib.import_module(os.path.basename(_ROOT))
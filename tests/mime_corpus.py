@@ -0,0 +1,96 @@
+"""
+Samples for the MimeTypes sniffing engine, built in code: (name, content, expected mime string).
+Shared by tests/test_mimetypes.py and benchmarks/bench_mime_corpus.py.
+"""
+import codecs
+import gzip
+import io
+import random
+import struct
+import tarfile
+import zipfile
+
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PPTX = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+
+
+def _zip(members, first=None) -> bytes:
+    """``first`` is an uncompressed (name, data) member written before the others, like EPUB / ODF 'mimetype'."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        if first is not None:
+            z.writestr(zipfile.ZipInfo(first[0]), first[1], compress_type=zipfile.ZIP_STORED)
+        for name, data in members:
+            z.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _ooxml(part_dir: str) -> list:
+    return [('[Content_Types].xml', '<Types/>'), ('_rels/.rels', 'x'), (part_dir + 'document.xml', 'x')]
+
+
+def _tar() -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tf:
+        info = tarfile.TarInfo('x.txt')
+        info.size = 5
+        tf.addfile(info, io.BytesIO(b'hello'))
+    return buffer.getvalue()
+
+
+def _bmp(noise) -> bytes:
+    pixels = noise(4 * 4 * 3)
+    file_header = struct.pack('<2sIHHI', b'BM', 14 + 40 + len(pixels), 0, 0, 14 + 40)
+    return file_header + struct.pack('<IiiHHIIiiII', 40, 4, 4, 1, 24, 0, len(pixels), 0, 0, 0, 0) + pixels
+
+
+def build_corpus(seed: int = 3) -> list:
+    rnd = random.Random(seed)
+    noise = rnd.randbytes
+    # incompressible members push the OOXML parts past the first 900 KB, so only the central directory has them
+    late_parts = [('a%d.bin' % i, noise(300000)) for i in range(3)] + _ooxml('word/')
+    html = b'<!DOCTYPE html><html><head><title>t</title></head><body><div>x</div></body></html>'
+    return [
+        ('pdf', b'%PDF-1.5\n' + noise(5000), 'application/pdf'),
+        ('png', b'\x89PNG\r\n\x1a\n' + noise(5000), 'image/png'),
+        ('jpeg', b'\xff\xd8\xff\xe0' + noise(5000), 'image/jpeg'),
+        ('tiff-le', b'II*\x00\x08\x00\x00\x00' + noise(500), 'image/tiff'),
+        ('tiff-be', b'MM\x00*\x00\x00\x00\x08' + noise(500), 'image/tiff'),
+        ('bmp', _bmp(noise), 'image/bmp'),
+        ('webp', b'RIFF\x10\x20\x00\x00WEBPVP8 ' + noise(500), 'image/webp'),
+        ('riff-wav', b'RIFF\x10\x20\x00\x00WAVEfmt ' + noise(500), 'application/octet-stream'),
+        ('zip', _zip([('a.txt', 'x' * 100)]), 'application/zip'),
+        ('docx', _zip(_ooxml('word/')), DOCX),
+        ('xlsx', _zip(_ooxml('xl/')), XLSX),
+        ('pptx', _zip(_ooxml('ppt/')), PPTX),
+        ('docx-late-parts', _zip(late_parts), DOCX),
+        ('epub', _zip([('OEBPS/a.html', '<html/>')], ('mimetype', 'application/epub+zip')), 'application/epub+zip'),
+        ('odt', _zip([('content.xml', '<x/>')], ('mimetype', 'application/vnd.oasis.opendocument.text')),
+         'application/vnd.oasis.opendocument.text'),
+        ('gzip', gzip.compress(b'x' * 1000), 'application/gzip'),
+        ('fake-gzip', b'\x1f\x8b\xff\xff' + noise(100), 'application/octet-stream'),
+        ('tar', _tar(), 'application/x-tar'),
+        ('html', html, 'text/html'),
+        ('html-ws-bom', codecs.BOM_UTF8 + b'\n\n   ' + html, 'text/html'),
+        ('html-upper', b'<HTML><BODY>x</BODY></HTML>', 'text/html'),
+        ('html-frag', b'<div><p>hello</p><a href="x">y</a></div>', 'text/html'),
+        ('html-utf16', codecs.BOM_UTF16_LE + html.decode().encode('utf-16-le'), 'text/html'),
+        ('xhtml', b'<?xml version="1.0"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><body/></html>', 'text/html'),
+        ('xml', b'<?xml version="1.0"?><root><a/></root>', 'text/xml'),
+        ('xml-nodecl', b'<root><item>1</item></root>', 'text/xml'),
+        ('svg', b'<svg xmlns="http://www.w3.org/2000/svg"/>', 'image/svg+xml'),
+        ('svg-decl', b'<?xml version="1.0"?>\n<!-- c -->\n<svg xmlns="http://www.w3.org/2000/svg"/>', 'image/svg+xml'),
+        ('json', b'{"a": 1}', 'application/json'),
+        ('json-ws', b'  \n [ {"a": 1} ]', 'application/json'),
+        ('json-bom', codecs.BOM_UTF8 + b'{"k": [1,2]}', 'application/json'),
+        ('text-like-bmp', b'BMW makes cars', 'text/plain'),
+        ('text-like-tiff', b'MM is a text', 'text/plain'),
+        ('text-like-tiff-le', b'II is also text', 'text/plain'),
+        ('bracket-text', b'[citation needed] the text goes on', 'text/plain'),
+        ('plain', 'Grüße, plain text\n'.encode() * 100, 'text/plain'),
+        ('plain-utf16', codecs.BOM_UTF16_BE + 'plain text'.encode('utf-16-be'), 'text/plain'),
+        ('nul-binary', b'abc\x00\x00\x01def' * 10, 'application/octet-stream'),
+        ('random', noise(10000), 'application/octet-stream'),
+        ('empty', b'', 'text/plain'),
+    ]
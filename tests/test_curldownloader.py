@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pycurl = pytest.importorskip('pycurl')
+
+DATA = random.Random(0).randbytes(12 << 20)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+class _RangeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _RangeHandler)
+        self.reset()
+
+    def reset(self):
+        self.ignore_range = False  # advertise ranges on HEAD, answer every GET with the whole body
+        self.fail_after = None  # drop the connection after this many body bytes of a response
+        self.stall_after = None  # stop sending after this many body bytes until `resume` is set
+        self.resume = threading.Event()
+        self.ranges = []  # Range header of every GET
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:%d/file' % self.server_port
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _head(self, code: int, start: int, end: int):
+        self.send_response(code)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        if code == 206:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(DATA)))
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._head(200, 0, len(DATA))
+
+    def do_GET(self):
+        server = self.server
+        requested = self.headers.get('Range')
+        server.ranges.append(requested)
+        start, end, code = 0, len(DATA), 200
+        if requested and not server.ignore_range and self.headers.get('If-Range', '"v1"') == '"v1"':
+            m = re.match(r'bytes=(\d+)-(\d*)', requested)
+            start, end, code = int(m.group(1)), int(m.group(2)) + 1 if m.group(2) else len(DATA), 206
+        self._head(code, start, end)
+        sent = 0
+        for pos in range(start, end, 65536):
+            if server.fail_after is not None and sent >= server.fail_after:
+                self.close_connection = True
+                return
+            if server.stall_after is not None and sent >= server.stall_after:
+                server.resume.wait(30)
+            chunk = DATA[pos:min(end, pos + 65536)]
+            try:
+                self.wfile.write(chunk)
+            except OSError:
+                return
+            sent += len(chunk)
+
+
+@pytest.fixture(scope='module')
+def server():
+    srv = _RangeServer()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def target(server, tmp_path):
+    server.reset()
+    return str(tmp_path / 'file.bin')
+
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_parts_are_fetched_as_concurrent_ranges(package, server, target):
+    result = package.CurlDownloader().download_to(server.url, target, parts=4, checksum=('sha256', SHA256))
+    assert result.get_status_code() == 200
+    assert _read(target) == DATA
+    assert len(server.ranges) == 4 and all(r.startswith('bytes=') for r in server.ranges)
+    assert not os.path.exists(target + '.part') and not os.path.exists(target + '.part.json')
+
+
+def test_interrupted_download_resumes_from_the_saved_ranges(package, server, target):
+    server.fail_after = 3 << 20
+    with pytest.raises(pycurl.error):
+        package.CurlDownloader().download_to(server.url, target, parts=2, retries=0)
+    with open(target + '.part.json') as f:
+        remaining = json.load(f)['ranges']
+    assert remaining and all(start > 0 for start, _ in remaining)
+
+    server.reset()
+    package.CurlDownloader().download_to(server.url, target, parts=2, checksum=('sha256', SHA256))
+    assert _read(target) == DATA
+    # the parts are fetched concurrently, so they reach the server in any order
+    assert sorted(server.ranges) == sorted('bytes=%d-%d' % (start, end - 1) for start, end in remaining)
+
+
+def test_server_ignoring_range_falls_back_to_one_get(package, server, target):
+    server.ignore_range = True
+    package.CurlDownloader().download_to(server.url, target, parts=4, checksum=('sha256', SHA256))
+    assert _read(target) == DATA
+    assert server.ranges[-1] is None  # the final, whole-body request
+    assert len(server.ranges) <= 4 + 4 + 1  # one restart with ranges at most, then one plain GET
+
+
+def test_checksum_mismatch_removes_the_partial_file(package, server, target):
+    with pytest.raises(ValueError):
+        package.CurlDownloader().download_to(server.url, target, checksum=('sha256', '0' * 64))
+    assert not os.path.exists(target)
+    assert not os.path.exists(target + '.part') and not os.path.exists(target + '.part.json')
+
+
+def test_killed_download_resumes_from_a_checkpoint(package, server, target):
+    server.stall_after = 6 << 20
+    root = os.path.dirname(os.path.dirname(os.path.abspath(package.__file__)))
+    code = 'import importlib, sys; sys.path.insert(0, %r); importlib.import_module(%r).CurlDownloader()' \
+           '.download_to(%r, %r)' % (root, package.__name__, server.url, target)
+    child = subprocess.Popen([sys.executable, '-c', code], cwd=os.path.dirname(target))
+    try:
+        deadline = time.monotonic() + 30
+        remaining = None
+        while time.monotonic() < deadline:
+            try:
+                with open(target + '.part.json') as f:
+                    remaining = json.load(f)['ranges']
+            except (OSError, ValueError):
+                pass
+            if remaining and remaining[0][0] > 0:
+                break
+            time.sleep(0.05)
+        os.kill(child.pid, signal.SIGKILL)
+    finally:
+        child.wait()
+        server.resume.set()
+    assert remaining and remaining[0][0] >= 4 << 20
+
+    server.reset()
+    package.CurlDownloader().download_to(server.url, target, checksum=('sha256', SHA256))
+    assert _read(target) == DATA
+    assert server.ranges[0].startswith('bytes=%d-' % remaining[0][0])
@@ -0,0 +1,77 @@
+import io
+import os
+
+import pytest
+
+from mime_corpus import build_corpus
+
+CORPUS = build_corpus()
+IDS = [name for name, _, _ in CORPUS]
+
+
+@pytest.fixture(scope='module')
+def corpus_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('mime_corpus')
+    for name, content, _ in CORPUS:
+        (directory / name).write_bytes(content)
+    return directory
+
+
+@pytest.mark.parametrize('name, content, expected', CORPUS, ids=IDS)
+def test_guess_by_bytes(package, name, content, expected):
+    assert str(package.MimeTypes.guess_by_bytes(content)) == expected
+
+
+@pytest.mark.parametrize('name, content, expected', CORPUS, ids=IDS)
+def test_guess_by_file(package, corpus_dir, name, content, expected):
+    assert str(package.MimeTypes.guess_by_file(str(corpus_dir / name))) == expected
+
+
+@pytest.mark.parametrize('name, content, expected', CORPUS, ids=IDS)
+def test_guess_by_buffer_keeps_position(package, name, content, expected):
+    buffer = io.BytesIO(content)
+    guessed = package.MimeTypes.guess_by_buffer(buffer)
+    assert buffer.tell() == 0
+    if name == 'docx-late-parts':  # a stream is only sniffed from its head, where the OOXML parts are missing
+        expected = 'application/zip'
+    assert str(guessed) == expected
+
+
+def test_guess_many_matches_guess_by_file(package, corpus_dir):
+    results = dict(package.MimeTypes.guess_many([str(corpus_dir)], max_workers=4))
+    assert {path.rsplit('/', 1)[-1]: str(mime) for path, mime in results.items()} == \
+        {name: expected for name, _, expected in CORPUS}
+
+
+def test_guess_by_bytes_only_sniffs_a_bounded_prefix(package):
+    # valid text for the whole window; what comes after it must not matter
+    content = b'plain text ' * 1000 + b'\xff\xfe\x00'
+    assert str(package.MimeTypes.guess_by_bytes(content)) == 'text/plain'
+
+
+def test_truncated_utf8_at_the_window_edge_is_still_text(package):
+    window = package.MimeTypes._SNIFF_SIZE
+    content = b'a' * (window - 1) + 'é'.encode() + b'tail'
+    assert str(package.MimeTypes.guess_by_bytes(content)) == 'text/plain'
+
+
+def test_lookups_by_name_and_mime_string(package):
+    mime = package.MimeTypes
+    assert str(mime.guess_by_file_name('archive.tar.gz')) == 'application/x-gtar'  # the longest suffix wins
+    assert str(mime.guess_by_file_name('x.TAR.GZ')) == 'application/x-gtar'
+    assert str(mime.guess_by_file_name('dir.tar/backup.tgz')) == 'application/x-gtar'
+    assert str(mime.guess_by_file_name('notes.txt.gz')) == 'application/gzip'
+    assert str(mime.guess_by_file_name('report.DOCX')) == 'application/vnd.openxmlformats-officedocument' \
+                                                          '.wordprocessingml.document'
+    assert mime.from_str('Text/HTML; charset=utf-8') is mime.from_str('text/html')
+    assert str(mime.from_str('no/such-type')) == 'application/octet-stream'
+
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo'), reason='needs FIFOs')
+def test_guess_by_file_skips_special_files(package, tmp_path):
+    fifo = str(tmp_path / 'pipe.txt')
+    os.mkfifo(fifo)
+    assert package.MimeTypes.guess_by_file(fifo) is None  # without blocking on open
+    if os.path.exists(os.devnull):
+        assert package.MimeTypes.guess_by_file(os.devnull) is None
+    assert str(package.MimeTypes.guess_by_file(str(tmp_path / 'missing.pdf'))) == 'application/pdf'
@@ -1,4 +1,3 @@
-import codecs
 import json
 import os
 import subprocess
@@ -11,13 +10,23 @@ from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver import DesiredCapabilities
 
-from .log import Log
+from .log import Log, RotatingFileHandler
 # from .pdfdriver import PDFDriver
 
+_MODULE_FILE_NAME = os.path.basename(__file__)
+
 
 # URLをダウンロードするためのライブラリ
 class WebDriver(ABC):
+    # errors logged from this module are also appended to error.log, through one shared file handler
+    _error_log = None
+
     def __init__(self, exec_bin=None):
+        if WebDriver._error_log is None:
+            WebDriver._error_log = RotatingFileHandler(
+                'error.log', level=Log.Level.ERROR, filter=lambda r: r.file_name == _MODULE_FILE_NAME
+            )
+            Log.add_handler(WebDriver._error_log)
         Log.i("Starting WebDriver in selenium ...")
         self._driver = None
         self._temp_dir_path = tempfile.TemporaryDirectory("_" + self.__class__.__name__).name
@@ -36,6 +45,7 @@ class WebDriver(ABC):
     def get_temp_dir(self):
         return self._temp_dir_path
 
+    @Log.timer('WebDriver.get_page_source')
     def get_page_source(self, url):
         if not url:
             return None
@@ -44,13 +54,10 @@ class WebDriver(ABC):
             try:
                 self._driver.get(url)
                 if self.get_status_code() != 200:
-                    with codecs.open('error.log', 'a', 'utf_8') as f:
-                        f.write('{0} E: Status code was not 200 from url \'{1}\'\n'.format(
-                            Log.get_datetime_str(), url
-                        ))
+                    Log.e('Status code was not 200 from url \'%s\'', url)
                     return None
             except TimeoutException:
-                Log.w('from \'%s\', TimeoutException was raised, retrying #%d' % (url, i))
+                Log.w('from \'%s\', TimeoutException was raised, retrying #%d', url, i)
             else:
                 # if re.search('\.pdf(?:\?.*)?$', url, re.IGNORECASE):
                 #     return WebDriver.wrap_content_tag(PDFDriver.get_content(url))
@@ -58,9 +65,7 @@ class WebDriver(ABC):
                 return self._driver.page_source
             i += 1
             time.sleep(20)
-        Log.e('Retrying failed')
-        with codecs.open('error.log', 'a', 'utf_8') as f:
-            f.write('{0} E: TimeoutException was raised from url \'{1}\'\n'.format(Log.get_datetime_str(), url))
+        Log.e('Retrying failed; TimeoutException was raised from url \'%s\'', url)
         return None
 
     def quit(self):